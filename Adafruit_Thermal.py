@@ -35,10 +35,776 @@
 # Python 2.X code using the library usu. needs to include the next line:
 from __future__ import print_function
 from serial import Serial
+import collections
+import threading
+import atexit
+try:
+	import queue
+except ImportError: # Python 2
+	import Queue as queue
+import unicodedata
+import socket
 import time
 import sys
+import os
+
+# Monotonic clock for pacing (immune to system clock adjustments, e.g.
+# NTP sync shortly after boot); plain time.time() on older Pythons.
+clock = getattr(time, 'monotonic', time.time)
+
+# Pacing engines.  timeoutWait() hands the printer's estimated resume
+# time to one of these, which passes the time until then.  Each records
+# how long each wait actually took (lastWait, totalWait, waitCount) and
+# how far past the target it ended (lastLate), for tuning & diagnosis.
+
+# Spins on the clock until the resume time.  Most precise, but burns a
+# full CPU core for as long as the printer is busy.  This was the
+# library's original (and only) behavior.
+class SpinPacer(object):
+
+	def __init__(self):
+		self.lastWait  = 0.0
+		self.lastLate  = 0.0
+		self.totalWait = 0.0
+		self.waitCount = 0
+
+	def wait(self, until):
+		start = clock()
+		now   = start
+		while now < until: now = clock()
+		self.record(start, now, until)
+
+	def record(self, start, end, until):
+		self.lastWait   = end - start
+		self.lastLate   = end - until if end > until else 0.0
+		self.totalWait += self.lastWait
+		self.waitCount += 1
+
+# Sleeps through most of the wait, leaving the CPU free for other work,
+# then spins only for the final 'spinTime' seconds to make up for sleep
+# granularity and scheduling jitter.
+class SleepPacer(SpinPacer):
+
+	def __init__(self, spinTime=0.0005):
+		SpinPacer.__init__(self)
+		self.spinTime = spinTime
+
+	def wait(self, until):
+		start = clock()
+		now   = start
+		if until - now > self.spinTime:
+			time.sleep(until - now - self.spinTime)
+			now = clock()
+		while now < until: now = clock()
+		self.record(start, now, until)
+
+# Flow-controlled pacing: ignores the time estimates altogether and
+# instead sends data as fast as the printer will accept it, going by
+# its busy output (the printer's DTR pin, enabled by initialize()).
+# 'busy' is a function returning True while the printer can't take
+# more data, e.g. reading whichever serial or GPIO input the DTR pin is
+# wired to; the driver polls it before every write, splitting writes
+# into blocks of 'blockSize' bytes so a busy signal is acted on within
+# one block.  With no 'busy' function, flow control is left entirely
+# to the serial port (RTS/CTS handshaking) and this never waits.  If
+# the printer stays busy for more than 'timeout' seconds (out of paper,
+# unplugged...), IOError is raised.
+class FlowPacer(SpinPacer):
+
+	def __init__(self, busy=None, blockSize=32, pollTime=0.0005,
+	  timeout=10.0):
+		SpinPacer.__init__(self)
+		self.busy      = busy
+		self.blockSize = blockSize if busy else None
+		self.pollTime  = pollTime
+		self.timeout   = timeout
+
+	def wait(self, until):
+		if self.busy is None: return
+		start = clock()
+		now   = start
+		while self.busy():
+			if now - start > self.timeout:
+				raise IOError('Printer busy for over %g s' %
+				  self.timeout)
+			time.sleep(self.pollTime)
+			now = clock()
+		self.record(start, now, now)
+
+# Closed-loop tuning of the print and feed time estimates.  Every so
+# often ('interval' seconds), right after a bitmap chunk or line of text
+# is issued, the printer is sent a status query.  It answers once it
+# has worked through everything ahead of the query, so the reply time
+# is a measure of how long the printer really took versus how long the
+# driver estimated (the time remaining until resumeTime).  The ratio of
+# the two, plus a safety 'margin', steers a 'scale' factor applied to
+# the nominal dotPrintTime and dotFeedTime: times shrink while the
+# printer keeps up and grow when it falls behind.  Each reply also
+# means the printer's buffer is empty, so the next command can go
+# right away.  Learned values are in 'scale', 'dotPrintTime' and
+# 'dotFeedTime', with recent (estimated, measured, scale) samples in
+# 'history'.
+#
+# Requires the printer's TX line to be connected and the port opened
+# with a read timeout (the constructor refuses adaptive=True on a
+# serial port without one); if a query goes unanswered, tuning stops.  Not
+# used in threaded mode, where output is sent by the writer thread.
+class TimingTuner(object):
+
+	def __init__(self, printer, interval=2.0, margin=0.15, gain=0.5,
+	  minScale=0.2, maxScale=2.0):
+		self.nominalPrint = printer.dotPrintTime
+		self.nominalFeed  = printer.dotFeedTime
+		self.interval     = interval
+		self.margin       = margin
+		self.gain         = gain
+		self.minScale     = minScale
+		self.maxScale     = maxScale
+		self.scale        = 1.0
+		self.enabled      = True
+		self.nextCheck    = clock() + interval
+		self.history      = []
+
+	@property
+	def dotPrintTime(self):
+		return self.nominalPrint * self.scale
+
+	@property
+	def dotFeedTime(self):
+		return self.nominalFeed * self.scale
+
+	def check(self, printer):
+		start = clock()
+		if (not self.enabled or start < self.nextCheck or
+		    printer.writer is not None):
+			return
+		estimate = printer.resumeTime - start
+		if estimate <= 0: return # Nothing in progress to measure
+
+		printer.transport.resetInput()
+		if printer.firmwareVersion >= 264:
+			printer.writeRaw(bytearray([27, 118, 0]))
+		else:
+			printer.writeRaw(bytearray([29, 114, 0]))
+		reply = printer.transport.read(1)
+		now   = clock()
+		if not reply:
+			self.enabled = False
+			return
+		measured = now - start
+		if printer.metrics is not None:
+			printer.metrics.queries.observe(measured)
+
+		target = self.scale * (measured / estimate) * (1 + self.margin)
+		scale  = self.scale + self.gain * (target - self.scale)
+		self.scale = min(max(scale, self.minScale), self.maxScale)
+		self.history.append((estimate, measured, self.scale))
+		del self.history[:-100]
+
+		printer.dotPrintTime = self.dotPrintTime
+		printer.dotFeedTime  = self.dotFeedTime
+		printer.resumeTime   = now # Printer has caught up
+		self.nextCheck       = now + self.interval
+
+# Transports: the link between the driver and the printer.  Each has
+# write(data) and read(n), flush() to push out anything it buffers,
+# drain() to wait until everything written has actually gone out,
+# resetInput() to discard unread input, and close().  Each also states
+# its pacing needs: 'paced' is True if the driver must throttle output
+# with its time estimates (because nothing else stops the printer's
+# buffer overflowing), and 'byteTime' gives the time per byte.
+
+# Base class; also a null transport that discards everything.
+class Transport(object):
+
+	paced    = False
+	byteTime = 0.0
+
+	def write(self, data):
+		pass
 
-class Adafruit_Thermal(Serial):
+	def read(self, n=1):
+		raise IOError('%s cannot read' % type(self).__name__)
+
+	def flush(self):
+		pass
+
+	def drain(self):
+		self.flush()
+
+	def resetInput(self):
+		pass
+
+	def close(self):
+		self.flush()
+
+# Serial port (via pySerial): the Adafruit printer's native interface.
+# No flow control by default, so output is paced.  Arguments are the
+# same as for pySerial's Serial class, with baud rate 19200 default.
+class SerialTransport(Transport):
+
+	paced = True
+
+	def __init__(self, port, baudrate=19200, *args, **kwargs):
+		self.port = Serial(port, baudrate, *args, **kwargs)
+		# Calculate time to issue one byte to the printer.
+		# 11 bits (not 8) to accommodate idle, start and
+		# stop bits.  Idle time might be unnecessary, but
+		# erring on side of caution here.
+		self.byteTime = 11.0 / float(baudrate)
+
+	def write(self, data):
+		self.port.write(data)
+
+	def read(self, n=1):
+		return self.port.read(n)
+
+	def drain(self):
+		self.port.flush() # Waits for output to be sent
+
+	def resetInput(self):
+		self.port.reset_input_buffer()
+
+	def close(self):
+		self.port.close()
+
+# Raw TCP, as used by Ethernet-attached ESC/POS printers (usually on
+# port 9100).  TCP and the printer's network interface provide flow
+# control, so no pacing is needed.  Connections are kept open: close()
+# returns the connection to a pool, to be picked up by the next
+# TcpTransport for the same printer; closeAll() closes pooled ones.
+class TcpTransport(Transport):
+
+	pool     = {}
+	poolLock = threading.Lock()
+
+	def __init__(self, host, port=9100, timeout=10.0):
+		self.address = (host, port)
+		self.timeout = timeout
+		self.sock    = None
+		self.reused  = False
+
+	def connect(self):
+		if self.sock is None:
+			with self.poolLock:
+				self.sock = self.pool.pop(self.address, None)
+			self.reused = self.sock is not None
+			if self.sock is None:
+				self.sock = socket.create_connection(
+				  self.address, self.timeout)
+		return self.sock
+
+	def write(self, data):
+		try:
+			self.connect().sendall(data)
+		except socket.error:
+			if not self.reused: raise
+			# Pooled connection went stale; try a fresh one
+			self.sock.close()
+			self.sock = None
+			self.connect().sendall(data)
+		self.reused = False
+
+	def read(self, n=1):
+		return self.connect().recv(n)
+
+	def close(self):
+		if self.sock is None: return
+		with self.poolLock:
+			if self.address not in self.pool:
+				self.pool[self.address] = self.sock
+				self.sock = None
+		if self.sock is not None:
+			self.sock.close()
+			self.sock = None
+
+	@classmethod
+	def closeAll(cls):
+		with cls.poolLock:
+			for sock in cls.pool.values():
+				sock.close()
+			cls.pool.clear()
+
+# Printer character device, e.g. /dev/usb/lp0 for USB printers.  The
+# kernel driver blocks writes while the printer is busy, so no pacing.
+class DeviceTransport(Transport):
+
+	def __init__(self, path='/dev/usb/lp0'):
+		try:
+			self.fd = os.open(path, os.O_RDWR)
+		except OSError:
+			self.fd = os.open(path, os.O_WRONLY) # No status reads
+		self.path = path
+
+	def write(self, data):
+		data = memoryview(data)
+		while len(data):
+			data = data[os.write(self.fd, data):]
+
+	def read(self, n=1):
+		return os.read(self.fd, n)
+
+	def close(self):
+		if self.fd is not None:
+			os.close(self.fd)
+			self.fd = None
+
+# In-memory buffer: everything written is appended to 'data' (and
+# 'writes' counts the writes), and reads are answered from 'replies'.
+# For testing, benchmarking and offline rendering.  Given a baud rate,
+# it's paced as if it were a serial link at that speed.
+class MemoryTransport(Transport):
+
+	def __init__(self, baudrate=None, replies=b''):
+		self.data    = bytearray()
+		self.writes  = 0
+		self.replies = bytearray(replies)
+		if baudrate:
+			self.paced    = True
+			self.byteTime = 11.0 / float(baudrate)
+
+	def write(self, data):
+		self.data   += data
+		self.writes += 1
+
+	def read(self, n=1):
+		data = bytes(self.replies[:n])
+		del self.replies[:n]
+		return data
+
+	def resetInput(self):
+		del self.replies[:]
+
+	def clear(self):
+		del self.data[:]
+		self.writes = 0
+
+# Standard output (to be piped through 'lp -o raw', for instance), or
+# any other binary file object.  Data accumulates in a large, reused
+# buffer and is written out in batches whenever it fills, when the
+# driver reaches the end of a job (see flushOutput()) and at exit.
+class StdoutSink(Transport):
+
+	def __init__(self, output=None, size=65536):
+		if output is None:
+			sys.stdout.flush()
+			output = getattr(sys.stdout, 'buffer', sys.stdout)
+		self.output = output
+		self.buffer = bytearray(size)
+		self.view   = memoryview(self.buffer)
+		self.fill   = 0
+		atexit.register(self.flush)
+
+	def write(self, data):
+		n = len(data)
+		if self.fill + n > len(self.buffer):
+			self.flush()
+			if n >= len(self.buffer):
+				self.output.write(data)
+				return
+		self.view[self.fill:self.fill + n] = data
+		self.fill += n
+
+	def flush(self):
+		if getattr(self.output, 'closed', False): return
+		if self.fill:
+			self.output.write(self.view[:self.fill])
+			self.fill = 0
+		self.output.flush()
+
+# Raster packing for printImage().  PIL's raw 1-bit data is already
+# packed 8 pixels/byte, MSB first, rows padded to a byte boundary --
+# the printer's own layout -- except that PIL sets bits for white and
+# the printer for black, so a byte-wise inversion is all that's needed.
+# NumPy, if installed, can do the same with packbits().
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+invertTable = bytes(bytearray(255 - i for i in range(256)))
+
+# Dithering: conversion of grayscale to the printer's black & white.
+#   'floyd'     Floyd-Steinberg error diffusion, by PIL (the default)
+#   'threshold' 50% threshold; crisp text and line art
+#   'bayer'     ordered dither with an 8x8 Bayer matrix; fully
+#               vectorized, so the fastest for photos
+#   'atkinson'  Atkinson error diffusion (passes on only 3/4 of the
+#               error); higher contrast than Floyd-Steinberg
+# All but 'floyd' work on NumPy arrays; without NumPy, 'threshold' is
+# done by PIL and the rest aren't available.
+ditherModes = ('floyd', 'threshold', 'bayer', 'atkinson')
+
+# n x n Bayer threshold matrix (n a power of 2), values 0 to n*n - 1.
+def bayerMatrix(n=8):
+	m = numpy.zeros((1, 1), numpy.int32)
+	while m.shape[0] < n:
+		m = numpy.block([[4 * m, 4 * m + 2], [4 * m + 3, 4 * m + 1]])
+	return m
+
+# Dithers an 'L' mode image, returning a NumPy array of booleans, True
+# for black, one per pixel.
+def ditherImage(image, mode):
+	gray = numpy.asarray(image)
+	if mode == 'threshold':
+		return gray < 128
+	if mode == 'bayer':
+		h, w   = gray.shape
+		levels = (bayerMatrix(8) * 4 + 2).astype(numpy.uint8)
+		levels = numpy.tile(levels, ((h + 7) // 8, (w + 7) // 8))
+		return gray < levels[:h, :w] # Thresholds spread over 0-255
+	if mode == 'atkinson':
+		# The error passed along each row has to be handled a
+		# pixel at a time; that passed to the two rows below is
+		# added a row at a time.
+		h, w  = gray.shape
+		black = numpy.zeros((h, w), bool)
+		below = numpy.zeros((2, w + 2), numpy.int32)
+		for y in range(h):
+			row  = (below[0, 1:w + 1] + gray[y]).tolist()
+			errs = [0] * w
+			out  = [False] * w
+			a = b = 0 # Errors from 1 and 2 pixels left
+			for x in range(w):
+				v = row[x] + a + b
+				if v < 128:
+					out[x] = True
+					e = v >> 3
+				else:
+					e = (v - 255) >> 3
+				errs[x] = e
+				b, a = a, e
+			black[y] = out
+			e = numpy.array(errs, numpy.int32)
+			below[0]  = below[1]
+			below[1]  = 0
+			below[0, 0:w]     += e
+			below[0, 1:w + 1] += e
+			below[0, 2:w + 2] += e
+			below[1, 1:w + 1] += e
+		return black
+	raise ValueError('Unknown dither mode %r' % (mode,))
+
+# Converts a PIL image to 1-bit if needed, dithered per 'dither' (see
+# above), crops to 'width' (384 pixels, the printer's full width, by
+# default) and returns (width, height, bitmap), where bitmap holds the
+# packed rows ready for printBitmap().  'method' is 'numpy' or 'pil';
+# default is NumPy when available (it's quicker).
+def packImage(image, method=None, width=384, dither='floyd'):
+	from PIL import Image
+
+	if method is None:
+		method = 'pil' if numpy is None else 'numpy'
+
+	black = None
+	if image.mode != '1':
+		if dither == 'floyd':
+			image = image.convert('1')
+		else:
+			if image.size[0] > width: # Only dither what prints
+				image = image.crop((0, 0, width, image.size[1]))
+			image = image.convert('L')
+			if numpy is not None:
+				black = ditherImage(image, dither)
+			elif dither == 'threshold':
+				image = image.point(lambda p: 255 * (p >= 128), '1')
+			else:
+				raise ImportError('%s dithering requires NumPy' %
+				  dither)
+	if image.size[0] > width:
+		image = image.crop((0, 0, width, image.size[1]))
+	width, height = image.size
+
+	if black is not None:
+		return width, height, numpy.packbits(black, axis=1)
+	if method == 'numpy':
+		black = numpy.logical_not(numpy.asarray(image))
+		return width, height, numpy.packbits(black, axis=1)
+
+	if width & 7:
+		# Pad rows to a whole byte with white, so the padding
+		# bits come out clear (unprinted) after inversion.
+		padded = Image.new('1', ((width + 7) & ~7, height), 1)
+		padded.paste(image, (0, 0))
+		image = padded
+	return width, height, image.tobytes().translate(invertTable)
+
+# Packs an image in horizontal tiles of 'tileHeight' rows, yielding
+# (width, height, bitmap) for each, so memory for the conversion work
+# is bounded by the tile size, not the image size.  Images no taller
+# than a tile come out exactly as from packImage().  With 'fit', the
+# image is scaled (up or down) to exactly 'width' pixels wide, each
+# tile resampled (Lanczos) straight from its area of the original; else
+# it's cropped to 'width'.  Error diffusion dithering starts afresh in
+# each tile; threshold and Bayer dithering are seamless (tileHeight
+# should be a multiple of 8 for the latter).
+def imageTiles(image, width=384, fit=False, dither='floyd',
+  tileHeight=1024):
+	from PIL import Image
+
+	w, h = image.size
+	if fit and w != width:
+		if image.mode in ('1', 'P'): # Else resize() can't filter
+			image = image.convert('L')
+		scale  = float(width) / w
+		height = max(1, int(round(h * scale)))
+		for y in range(0, height, tileHeight):
+			n    = min(tileHeight, height - y)
+			tile = image.resize((width, n), Image.LANCZOS,
+			  (0, y / scale, w, min(h, (y + n) / scale)))
+			yield packImage(tile, width=width, dither=dither)
+	elif h <= tileHeight:
+		yield packImage(image, width=width, dither=dither)
+	else:
+		for y in range(0, h, tileHeight):
+			tile = image.crop((0, y, min(w, width),
+			  min(h, y + tileHeight)))
+			yield packImage(tile, width=width, dither=dither)
+
+# Runs an iterable (e.g. imageTiles()) in a background thread, up to
+# 'depth' items ahead of the caller, yielding the items in order.  The
+# next image band is then decoded, dithered and packed while the
+# caller prints the current one (PIL and NumPy release the GIL for
+# much of that work).  Errors in the iterable are re-raised in the
+# caller.  If the caller stops early, the thread stops too.
+def prefetch(iterable, depth=1):
+	items = queue.Queue(depth)
+	stop  = threading.Event()
+	end   = object()
+
+	def run():
+		try:
+			for item in iterable:
+				while not stop.is_set():
+					try:
+						items.put((item, None), timeout=0.1)
+						break
+					except queue.Full:
+						pass
+				if stop.is_set(): return
+			item = (end, None)
+		except Exception as e:
+			item = (end, e)
+		items.put(item)
+
+	thread = threading.Thread(target=run)
+	thread.daemon = True
+	thread.start()
+	try:
+		while True:
+			item, error = items.get()
+			if item is end:
+				if error is not None: raise error
+				return
+			yield item
+	finally:
+		stop.set()
+		while thread.is_alive(): # Unblock any final put()
+			try:
+				items.get(timeout=0.1)
+			except queue.Empty:
+				pass
+
+# Finds runs of at least 'minRun' blank (all-zero) rows in a packed
+# bitmap (a 1-D memoryview of bytes), looking only at the first
+# 'clipped' bytes of each row -- the part the printer gets.  Returns a
+# list of (start, end) row ranges.
+def blankRuns(data, height, rowBytes, clipped, minRun):
+	if numpy is not None:
+		rows  = numpy.frombuffer(data, numpy.uint8,
+		  height * rowBytes).reshape(height, rowBytes)
+		blank = numpy.logical_not(rows[:, :clipped].any(axis=1))
+		edges = numpy.flatnonzero(numpy.diff(numpy.concatenate(
+		  ([False], blank, [False])).astype(numpy.int8)))
+		return [(int(a), int(b)) for a, b in
+		  zip(edges[0::2], edges[1::2]) if b - a >= minRun]
+	zero  = bytes(bytearray(clipped))
+	runs  = []
+	start = None
+	for y in range(height + 1):
+		if y < height and (data[y * rowBytes:y * rowBytes +
+		  clipped].tobytes() == zero):
+			if start is None: start = y
+		elif start is not None:
+			if y - start >= minRun: runs.append((start, y))
+			start = None
+	return runs
+
+# Number of black dots (set bits) in a run of packed bitmap bytes.
+popTable = bytes(bytearray(bin(i).count('1') for i in range(256)))
+
+def inkDots(data):
+	if numpy is not None:
+		return int(numpy.unpackbits(
+		  numpy.frombuffer(data, numpy.uint8)).sum())
+	return sum(bytearray(bytes(data).translate(popTable)))
+
+# Black dots in rows 'y' through 'y' + 'n' - 1 of a packed bitmap,
+# counting only the first 'clipped' bytes of each row.
+def bandInk(data, y, n, rowBytes, clipped):
+	if rowBytes == clipped:
+		return inkDots(data[y * rowBytes:(y + n) * rowBytes])
+	return sum(inkDots(data[r:r + clipped]) for r in
+	  range(y * rowBytes, (y + n) * rowBytes, rowBytes))
+
+# Text layout for printWrapped(): word wrapping and alignment of a
+# paragraph to the printer's line width, all in one pass.  Words are
+# separated by whitespace (runs of it count as one space, though a
+# paragraph's leading spaces are kept); a word too long for a line is
+# broken across lines.  'align' is 'L' (left, the
+# default), 'C' (center), 'R' (right) or 'J' (justified: spaces widened
+# to fill each line but a paragraph's last); with 'pad', left-aligned
+# and centered lines are padded with spaces to the full width (e.g. for
+# inverse or underlined bars).  'indent' is the column the first line
+# starts in; if not even the first word fits there, the first line is
+# empty (i.e. the line in progress is simply ended).  Returns a tuple
+# of lines, without newlines.  Layouts are cached (least recently used
+# discarded first), so repeated strings are laid out only once.
+layoutCacheSize = 512
+layoutCache     = collections.OrderedDict()
+layoutLock      = threading.Lock()
+
+def wrapText(text, width, align='L', pad=False, indent=0):
+	key = (text, width, align, pad, indent)
+	with layoutLock:
+		lines = layoutCache.pop(key, None)
+		if lines is not None:
+			layoutCache[key] = lines # Now most recent
+			return lines
+	lines = []
+	room  = width - indent
+	for paragraph in text.split('\n'):
+		words = paragraph.split()
+		if words and paragraph[0] == ' ': # Keep indentation
+			words[0] = paragraph[:paragraph.index(words[0])] + (
+			  words[0])
+		line  = []
+		size  = 0 # Length of line with single spaces
+		n     = len(lines)
+		for word in words:
+			while len(word) > width: # Break overlong words
+				if line or room < width:
+					lines.append(line)
+					room = width
+				lines.append([word[:width]])
+				word = word[width:]
+				line, size = [], 0
+			if line and size + 1 + len(word) > room:
+				lines.append(line)
+				line, size, room = [], 0, width
+			elif not line and len(word) > room:
+				lines.append([]) # End line in progress
+				room = width
+			size += len(word) + (1 if line else 0)
+			line.append(word)
+		lines.append(line)
+		room = width
+		# Align the paragraph's lines, now that they're known
+		for i in range(n, len(lines)):
+			words = lines[i]
+			if i == 0 and indent and not words:
+				lines[i] = '' # Just ends the line in progress
+				continue
+			space = (width - indent if i == 0 else width) - (
+			  sum(len(w) for w in words) + len(words) - 1
+			  if words else 0)
+			if align == 'J' and i < len(lines) - 1 and len(words) > 1:
+				gaps, extra = divmod(space, len(words) - 1)
+				lines[i] = ''.join(w + ' ' * (1 + gaps +
+				  (j < extra)) for j, w in enumerate(words[:-1])) + (
+				  words[-1])
+				continue
+			line = ' '.join(words)
+			if   align == 'R': line = ' ' * space + line
+			elif align == 'C':
+				line = ' ' * (space // 2) + line
+				if pad: line += ' ' * (space - space // 2)
+			elif pad: line += ' ' * space
+			lines[i] = line
+	lines = tuple(lines)
+	with layoutLock:
+		layoutCache[key] = lines
+		while len(layoutCache) > layoutCacheSize:
+			layoutCache.popitem(False)
+	return lines
+
+# Transcoding of text to the printer's code pages (see setCodePage()).
+# Each code page gets a table for str.translate(), built once from the
+# matching Python codec, mapping Unicode characters to the page's byte
+# values (as latin-1 characters, which writeRaw() sends as-is).  Any
+# character the page lacks is approximated, on first sight, by its
+# compatibility decomposition without accents (NFKD: 'e' for 'e acute',
+# 'fi' for the ligature), or from asciiFallback, or failing those '?';
+# the result is kept in the table.  Pages with no Python codec (MIK,
+# CP755, Iran, Latvian, Thai) get ASCII and approximations only.
+codepageCodecs = {
+  0: 'cp437',      1: 'shift_jis',  2: 'cp850',      3: 'cp860',
+  4: 'cp863',      5: 'cp865',      6: 'cp1251',     7: 'cp866',
+  15: 'cp862',     16: 'cp1252',    17: 'cp1253',    18: 'cp852',
+  19: 'cp858',     22: 'cp864',     23: 'latin-1',   24: 'cp737',
+  25: 'cp1257',    27: 'cp720',     28: 'cp855',     29: 'cp857',
+  30: 'cp1250',    31: 'cp775',     32: 'cp1254',    33: 'cp1255',
+  34: 'cp1256',    35: 'cp1258',    36: 'iso8859_2', 37: 'iso8859_3',
+  38: 'iso8859_4', 39: 'iso8859_5', 40: 'iso8859_6', 41: 'iso8859_7',
+  42: 'iso8859_8', 43: 'iso8859_9', 44: 'iso8859_15',
+  46: 'cp856',     47: 'cp874' }
+
+# Punctuation etc. that NFKD leaves alone, by code point.
+asciiFallback = {
+  0x2010: u'-',  0x2011: u'-',  0x2012: u'-',  0x2013: u'-',
+  0x2014: u'--', 0x2015: u'--', 0x2018: u"'",  0x2019: u"'",
+  0x201A: u',',  0x201B: u"'",  0x201C: u'"',  0x201D: u'"',
+  0x201E: u',,', 0x2022: u'*',  0x2032: u"'",  0x2033: u'"',
+  0x2039: u'<',  0x203A: u'>',  0x00AB: u'<<', 0x00BB: u'>>',
+  0x2212: u'-',  0x00D7: u'x',  0x00F7: u'/',  0x20AC: u'EUR',
+  0x00A9: u'(C)', 0x00AE: u'(R)', 0x2122: u'TM', 0x00B0: u'deg',
+  0x00DF: u'ss', 0x00C6: u'AE', 0x00E6: u'ae', 0x0152: u'OE',
+  0x0153: u'oe', 0x00D8: u'O',  0x00F8: u'o',  0x0141: u'L',
+  0x0142: u'l',  0x00A0: u' ',  0x200B: u'',   0xFEFF: u'' }
+
+try:
+	unichr
+except NameError: # Python 3
+	unichr = chr
+
+class CodepageTable(dict):
+
+	def __init__(self, codec=None):
+		dict.__init__(self, ((c, c) for c in range(128)))
+		if codec is None: return
+		for b in range(255, 127, -1): # Lowest byte wins
+			try:
+				c = bytes(bytearray([b])).decode(codec)
+			except UnicodeDecodeError:
+				continue
+			if len(c) == 1 and ord(c) >= 128:
+				self[ord(c)] = b
+
+	def __missing__(self, c):
+		text = asciiFallback.get(c)
+		if text is None:
+			text = u''.join(d for d in
+			  unicodedata.normalize('NFKD', unichr(c))
+			  if not unicodedata.combining(d))
+			if text == unichr(c): text = u'?'
+		out = []
+		for d in text:
+			v = self[ord(d)] if ord(d) != c else ord('?')
+			out.append(unichr(v) if isinstance(v, int) else v)
+		self[c] = out = u''.join(out)
+		return out
+
+codepageTables = {}
+
+# The (shared) translation table for code page 'page'.
+def codepageTable(page):
+	table = codepageTables.get(page)
+	if table is None:
+		table = CodepageTable(codepageCodecs.get(page))
+		codepageTables[page] = table
+	return table
+
+class Adafruit_Thermal(object):
 
 	resumeTime      =   0.0
 	byteTime        =   0.0
@@ -54,90 +820,169 @@ class Adafruit_Thermal(Serial):
 	defaultHeatTime =   120
 	firmwareVersion =   268
 	writeToStdout   = False
-
+	paced           = False
+	rasterCache     =  None
+	writer          =  None
+	pacer           =  None
+	tuner           =  None
+	metrics         =  None
+	elideBlank      =  True
+	minBlankRun     =     4
+	bufferSize      =  4096
+	tileHeight      =  1024
+	prefetchBands   =     1
+	codeTable       =  None
+	inkBase         =   1.0
+	inkFull         =    96
+
+	# Output goes through a transport (see above).  With a port name
+	# and optional baud rate, plus any other pySerial arguments, it's
+	# a SerialTransport.  Or pass any other kind of transport with the
+	# 'transport' argument.
 	def __init__(self, *args, **kwargs):
 		# NEW BEHAVIOR: if no parameters given, output is written
 		# to stdout, to be piped through 'lp -o raw' (old behavior
 		# was to use default port & baud rate).
-		baudrate = 19200
-		if len(args) == 0:
-			self.writeToStdout = True
-		if len(args) == 1:
-			# If only port is passed, use default baud rate.
-			args = [ args[0], baudrate ]
-		elif len(args) == 2:
-			# If both passed, use those values.
-			baudrate = args[1]
 
 		# Firmware is assumed version 2.68.  Can override this
 		# with the 'firmware=X' argument, where X is the major
 		# version number * 100 + the minor version number (e.g.
 		# pass "firmware=264" for version 2.64.
-		self.firmwareVersion = kwargs.get('firmware', 268)
+		self.firmwareVersion = kwargs.pop('firmware', 268)
+		heatTime = kwargs.pop('heattime', self.defaultHeatTime)
 
-		if self.writeToStdout is False:
-			# Calculate time to issue one byte to the printer.
-			# 11 bits (not 8) to accommodate idle, start and
-			# stop bits.  Idle time might be unnecessary, but
-			# erring on side of caution here.
-			self.byteTime = 11.0 / float(baudrate)
+		# Optional RasterCache (see RasterCache.py) used by
+		# printImage() for images loaded from files.
+		self.rasterCache = kwargs.pop('rasterCache', None)
 
-			Serial.__init__(self, *args, **kwargs)
-
-			# Remainder of this method was previously in begin()
-
-			# The printer can't start receiving data immediately
-			# upon power up -- it needs a moment to cold boot
-			# and initialize.  Allow at least 1/2 sec of uptime
-			# before printer can receive data.
-			self.timeoutSet(0.5)
-
-			self.wake()
-			self.reset()
-
-			# Description of print settings from p. 23 of manual:
-			# ESC 7 n1 n2 n3 Setting Control Parameter Command
-			# Decimal: 27 55 n1 n2 n3
-			# max heating dots, heating time, heating interval
-			# n1 = 0-255 Max heat dots, Unit (8dots), Default: 7 (64 dots)
-			# n2 = 3-255 Heating time, Unit (10us), Default: 80 (800us)
-			# n3 = 0-255 Heating interval, Unit (10us), Default: 2 (20us)
-			# The more max heating dots, the more peak current
-			# will cost when printing, the faster printing speed.
-			# The max heating dots is 8*(n1+1).  The more heating
-			# time, the more density, but the slower printing
-			# speed.  If heating time is too short, blank page
-			# may occur.  The more heating interval, the more
-			# clear, but the slower printing speed.
-
-			heatTime = kwargs.get('heattime', self.defaultHeatTime)
-			self.writeBytes(
-			  27,       # Esc
-			  55,       # 7 (print settings)
-			  11,       # Heat dots
-			  heatTime, # Lib default
-			  40)       # Heat interval
-
-			# Description of print density from p. 23 of manual:
-			# DC2 # n Set printing density
-			# Decimal: 18 35 n
-			# D4..D0 of n is used to set the printing density.
-			# Density is 50% + 5% * n(D4-D0) printing density.
-			# D7..D5 of n is used to set the printing break time.
-			# Break time is n(D7-D5)*250us.
-			# (Unsure of default values -- not documented)
-
-			printDensity   = 10 # 100%
-			printBreakTime =  2 # 500 uS
-
-			self.writeBytes(
-			  18, # DC2
-			  35, # Print density
-			  (printBreakTime << 5) | printDensity)
-			self.dotPrintTime = 0.03
-			self.dotFeedTime  = 0.0021
+		# Threaded output mode (see startWriter()).
+		threaded  = kwargs.pop('threaded', False)
+		queueSize = kwargs.pop('queueSize', 262144)
+
+		# Closed-loop tuning of print/feed times (see TimingTuner).
+		adaptive  = kwargs.pop('adaptive', False)
+
+		# Optional Metrics registry (see Metrics.py).
+		self.metrics = kwargs.pop('metrics', None)
+
+		# Blank rows in bitmaps are fed, not printed (see
+		# printBitmap()); pass elideBlank=False to print them.
+		self.elideBlank = kwargs.pop('elideBlank', True)
+
+		# When writing to stdout, 'output' can name some other
+		# (binary) file object to write to instead.
+		output = kwargs.pop('output', None)
+
+		pacing    = kwargs.pop('pacing', 'sleep')
+		transport = kwargs.pop('transport', None)
+		if transport is None:
+			if len(args) == 0:
+				transport = StdoutSink(output)
+			else:
+				if pacing == 'rtscts': kwargs['rtscts'] = True
+				transport = SerialTransport(*args, **kwargs)
+		elif pacing == 'rtscts' and hasattr(transport, 'port'):
+			transport.port.rtscts = True
+		if (pacing in ('rtscts', 'cts', 'dsr') and
+		    not hasattr(transport, 'port')):
+			# Flow control reads the serial port's inputs.
+			raise ValueError('pacing=%r needs a serial port' %
+			  pacing)
+		if (adaptive and isinstance(transport, SerialTransport) and
+		    transport.port.timeout is None):
+			# The tuner's status queries would block forever
+			# on a printer that doesn't answer.
+			transport.close()
+			raise ValueError('adaptive timing needs a port read '
+			  'timeout, e.g. timeout=5')
+		self.transport     = transport
+		self.writeToStdout = isinstance(transport, StdoutSink)
+		self.paced         = transport.paced
+		self.byteTime      = transport.byteTime
+		self.dotPrintTime  = 0.03
+		self.dotFeedTime   = 0.0021
+
+		# Pacing engine used by timeoutWait(): 'sleep' (default)
+		# or 'spin' (busy-wait; precise but CPU-hungry), or pass
+		# any object with a wait(until) method.  Alternately, if
+		# the printer's DTR (busy) pin is connected, use flow
+		# control instead of time estimates: 'rtscts' if it's
+		# wired to the port's CTS input and the port supports
+		# hardware handshaking, else 'cts' or 'dsr' to poll that
+		# input (or pass a FlowPacer to read it some other way).
+		# The named flow modes need a serial port (SerialTransport).
+		if pacing == 'sleep':
+			self.pacer = SleepPacer()
+		elif pacing == 'spin':
+			self.pacer = SpinPacer()
+		elif pacing == 'rtscts':
+			self.pacer = FlowPacer()
+		elif pacing == 'cts':
+			self.pacer = FlowPacer(lambda: not transport.port.cts)
+		elif pacing == 'dsr':
+			self.pacer = FlowPacer(lambda: not transport.port.dsr)
 		else:
-			self.reset() # Inits some vars
+			self.pacer = pacing
+
+		if threaded: self.startWriter(queueSize)
+		self.initialize(heatTime)
+		if self.paced and adaptive: self.tuner = TimingTuner(self)
+
+	# Power-up sequence and print settings, issued by the constructor
+	# whatever the transport (timeouts only hold up output that's
+	# paced, though).  Most of this was previously in begin().
+	def initialize(self, heatTime=defaultHeatTime):
+		# The printer can't start receiving data immediately
+		# upon power up -- it needs a moment to cold boot
+		# and initialize.  Allow at least 1/2 sec of uptime
+		# before printer can receive data.
+		self.timeoutSet(0.5)
+
+		self.wake()
+		self.reset()
+
+		# Enable the printer's DTR busy output if using flow control
+		if isinstance(self.pacer, FlowPacer):
+			self.writeBytes(29, 97, 1 << 5)
+
+		# Description of print settings from p. 23 of manual:
+		# ESC 7 n1 n2 n3 Setting Control Parameter Command
+		# Decimal: 27 55 n1 n2 n3
+		# max heating dots, heating time, heating interval
+		# n1 = 0-255 Max heat dots, Unit (8dots), Default: 7 (64 dots)
+		# n2 = 3-255 Heating time, Unit (10us), Default: 80 (800us)
+		# n3 = 0-255 Heating interval, Unit (10us), Default: 2 (20us)
+		# The more max heating dots, the more peak current
+		# will cost when printing, the faster printing speed.
+		# The max heating dots is 8*(n1+1).  The more heating
+		# time, the more density, but the slower printing
+		# speed.  If heating time is too short, blank page
+		# may occur.  The more heating interval, the more
+		# clear, but the slower printing speed.
+
+		self.writeBytes(
+		  27,       # Esc
+		  55,       # 7 (print settings)
+		  11,       # Heat dots
+		  heatTime, # Lib default
+		  40)       # Heat interval
+
+		# Description of print density from p. 23 of manual:
+		# DC2 # n Set printing density
+		# Decimal: 18 35 n
+		# D4..D0 of n is used to set the printing density.
+		# Density is 50% + 5% * n(D4-D0) printing density.
+		# D7..D5 of n is used to set the printing break time.
+		# Break time is n(D7-D5)*250us.
+		# (Unsure of default values -- not documented)
+
+		printDensity   = 10 # 100%
+		printBreakTime =  2 # 500 uS
+
+		self.writeBytes(
+		  18, # DC2
+		  35, # Print density
+		  (printBreakTime << 5) | printDensity)
 
 	# Because there's no flow control between the printer and computer,
 	# special care must be taken to avoid overrunning the printer's
@@ -153,12 +998,145 @@ class Adafruit_Thermal(Serial):
 
 	# Sets estimated completion time for a just-issued task.
 	def timeoutSet(self, x):
-		self.resumeTime = time.time() + x
+		if self.writer is not None:
+			self.queueEvent(x)
+		else:
+			self.resumeTime = clock() + x
 
 	# Waits (if necessary) for the prior task to complete.
 	def timeoutWait(self):
-		if self.writeToStdout is False:
-			while (time.time() - self.resumeTime) < 0: pass
+		if self.paced:
+			if self.writer is not None:
+				self.queueEvent(None)
+			else:
+				self.pacer.wait(self.resumeTime)
+				if self.metrics is not None:
+					self.metrics.waits.observe(
+					  self.pacer.lastWait)
+
+	# Threaded output mode: rather than waiting on the printer, the
+	# calling thread encodes commands into a queue (up to queueSize
+	# bytes) and returns immediately.  A background writer thread
+	# drains the queue to the printer, paced exactly as the commands
+	# would have been.  If the queue is full, callers block until
+	# there's room.  flushQueue() waits until everything queued has
+	# been sent; join() also stops the writer thread, returning to
+	# direct output.  The queue holds data and timing events in the
+	# same form as a PrintJob, plus events that are functions to be
+	# called when the writer gets to them (see printJob()).
+	def startWriter(self, queueSize=262144):
+		if self.writer is not None: return
+		self.queueSize   = queueSize
+		self.queueData   = bytearray()
+		self.queueTiming = []
+		self.queueBusy   = False
+		self.queueStop   = False
+		self.queueError  = None
+		self.queueLock   = threading.Condition()
+		self.writer      = threading.Thread(target=self.writerLoop)
+		self.writer.daemon = True
+		self.writer.start()
+		atexit.register(self.join) # Don't lose queued output
+
+	def queueWrite(self, data):
+		with self.queueLock:
+			while (len(self.queueData) >= self.queueSize and
+			       self.queueError is None):
+				self.queueLock.wait()
+			self.checkWriter()
+			self.queueData += data
+			self.queueLock.notify_all()
+
+	# Queues a timeout set (x = seconds) or wait (x = None) event.
+	def queueEvent(self, x):
+		with self.queueLock:
+			self.checkWriter()
+			event = (len(self.queueData), x)
+			if x is None and self.queueTiming and (
+			  self.queueTiming[-1] == event):
+				return # Redundant wait
+			self.queueTiming.append(event)
+			self.queueLock.notify_all()
+
+	# Re-raises (in the calling thread) any error that stopped the
+	# writer thread, e.g. a serial port failure.
+	def checkWriter(self):
+		if self.queueError is not None:
+			error, self.queueError = self.queueError, None
+			self.writer = None
+			raise error
+
+	def writerLoop(self):
+		while True:
+			with self.queueLock:
+				while not (self.queueData or self.queueTiming or
+				           self.queueStop):
+					self.queueLock.wait()
+				if not (self.queueData or self.queueTiming):
+					break
+				data, timing     = self.queueData, self.queueTiming
+				self.queueData   = bytearray()
+				self.queueTiming = []
+				self.queueBusy   = True
+				self.queueLock.notify_all()
+			try:
+				data = memoryview(data)
+				pos  = 0
+				for offset, x in timing:
+					if offset > pos:
+						self.transmit(data[pos:offset])
+						pos = offset
+					if x is None:
+						self.pacer.wait(self.resumeTime)
+						if self.metrics is not None:
+							self.metrics.waits.observe(
+							  self.pacer.lastWait)
+					elif callable(x):
+						x()
+					else:
+						self.resumeTime = clock() + x
+				if pos < len(data):
+					self.transmit(data[pos:])
+				self.transport.flush()
+			except Exception as e:
+				with self.queueLock:
+					self.queueError = e
+					self.queueBusy  = False
+					self.queueLock.notify_all()
+				break
+			with self.queueLock:
+				self.queueBusy = False
+				self.queueLock.notify_all()
+
+	# Waits until everything queued has been sent to the printer.
+	def flushQueue(self):
+		if self.writer is None: return
+		with self.queueLock:
+			while ((self.queueData or self.queueTiming or
+			        self.queueBusy) and self.queueError is None):
+				self.queueLock.wait()
+			self.checkWriter()
+
+	# Sends anything queued, then stops the writer thread.
+	def join(self):
+		if self.writer is None: return
+		self.flushQueue()
+		with self.queueLock:
+			self.queueStop = True
+			self.queueLock.notify_all()
+		self.writer.join()
+		self.writer = None
+
+	# Reads n bytes from the printer (where the transport allows).
+	def read(self, n=1):
+		self.flushQueue()
+		return self.transport.read(n)
+
+	# Sends anything pending, then closes the transport.
+	def close(self):
+		self.join()
+		self.flushOutput()
+		self.transport.close()
 
 	# Printer performance may vary based on the power supply voltage,
 	# thickness of paper, phase of the moon and other seemingly random
@@ -176,51 +1154,111 @@ class Adafruit_Thermal(Serial):
 		# compatibility with Arduino library
 		self.dotPrintTime = p / 1000000.0
 		self.dotFeedTime  = f / 1000000.0
+		if self.tuner is not None:
+			# New baseline for tuning
+			self.tuner = TimingTuner(self)
+
+	# Issues data (a string, bytes or any buffer object) to the
+	# printer (or stdout) as-is: no pacing, no paper accounting.
+	# All output passes through here.
+	def writeRaw(self, data):
+		if isinstance(data, type(u'')):
+			data = data.encode('latin-1')
+		if self.writer is not None:
+			self.queueWrite(data)
+		else:
+			self.transmit(data)
+
+	# Sends data through the transport.
+	def transmit(self, data):
+		block = getattr(self.pacer, 'blockSize', None)
+		if block and len(data) > block and self.paced:
+			# Flow control: check before each block, and let
+			# each drain from the port's output buffer before
+			# checking again, else the busy signal lags far
+			# behind what's been sent.
+			data = memoryview(data)
+			for i in range(0, len(data), block):
+				self.pacer.wait(0)
+				self.transport.write(data[i:i + block])
+				self.transport.drain()
+		else:
+			self.transport.write(data)
 
 	# 'Raw' byte-writing method
 	def writeBytes(self, *args):
-		if self.writeToStdout:
-			for arg in args:
-				sys.stdout.write(chr(arg))
-		else:
-			self.timeoutWait()
-			self.timeoutSet(len(args) * self.byteTime)
-			for arg in args:
-				super(Adafruit_Thermal, self).write(chr(arg))
-
-	# Override write() method to keep track of paper feed.
+		self.timeoutWait()
+		self.timeoutSet(len(args) * self.byteTime)
+		self.writeRaw(bytearray(args))
+		if self.metrics is not None: self.metrics.command(args)
+
+	# Override write() method to keep track of paper feed.  Each
+	# character is accounted for exactly as in the Arduino library
+	# (column count, wrap at maxColumn, blank vs. printed lines), but
+	# rather than issuing text a byte at a time, each printed line --
+	# up to and including the newline or the character that triggers
+	# a wrap -- is sent to the printer in a single write, and the sum
+	# of its per-character time estimates is applied once afterward.
 	def write(self, *data):
-		for i in range(len(data)):
-			c = data[i]
+		for text in data:
+			if (self.codeTable is not None and
+			    isinstance(text, type(u''))):
+				text = text.translate(self.codeTable)
+			elif isinstance(text, (bytes, bytearray)) and (
+			  not isinstance(text, str)):
+				# Bytes (Python 3) are sent as-is; as latin-1
+				# text, each byte is one character, the same as
+				# writeRaw() sends, and column counting works.
+				text = bytes(text).decode('latin-1')
+			if self.metrics is not None:
+				self.metrics.count('text', len(text))
 			if self.writeToStdout:
-				sys.stdout.write(c)
+				self.writeRaw(text)
 				continue
-			if c != 0x13:
-				self.timeoutWait()
-				super(Adafruit_Thermal, self).write(c)
-				d = self.byteTime
-				if ((c == '\n') or
-				    (self.column == self.maxColumn)):
-					# Newline or wrap
-					if self.prevByte == '\n':
-						# Feed line (blank)
-						d += ((self.charHeight +
-						       self.lineSpacing) *
-						      self.dotFeedTime)
-					else:
-						# Text line
-						d += ((self.charHeight *
-						       self.dotPrintTime) +
-						      (self.lineSpacing *
-						       self.dotFeedTime))
-						self.column = 0
-						# Treat wrap as newline
-						# on next pass
-						c = '\n'
+			i = 0
+			n = len(text)
+			while i < n:
+				# Locate the character that ends the current
+				# line: next newline or wrap, whichever's first.
+				# (A column already past maxColumn, e.g. after
+				# switching to double width, never wraps.)
+				end = text.find('\n', i)
+				if end < 0: end = n
+				if self.column <= self.maxColumn:
+					wrap = i + self.maxColumn - self.column
+					if wrap < end: end = wrap
+				if end >= n:
+					# Partial line, no feed yet
+					self.timeoutWait()
+					self.writeRaw(text[i:])
+					self.timeoutSet((n - i) * self.byteTime)
+					self.column  += n - i
+					self.prevByte = text[-1]
+					break
+				d = (end + 1 - i) * self.byteTime
+				if end > i: prev = text[end - 1]
+				else:       prev = self.prevByte
+				self.column += end - i
+				if prev == '\n':
+					# Feed line (blank)
+					d += ((self.charHeight +
+					       self.lineSpacing) *
+					      self.dotFeedTime)
+					self.prevByte = text[end]
 				else:
-					self.column += 1
+					# Text line
+					d += ((self.charHeight *
+					       self.dotPrintTime) +
+					      (self.lineSpacing *
+					       self.dotFeedTime))
+					self.column = 0
+					# Treat wrap as newline on next pass
+					self.prevByte = '\n'
+				self.timeoutWait()
+				self.writeRaw(text[i:end + 1])
 				self.timeoutSet(d)
-				self.prevByte = c
+				if self.tuner is not None: self.tuner.check(self)
+				i = end + 1
 
 	# The bulk of this method was moved into __init__,
 	# but this is left here for compatibility with older
@@ -241,6 +1279,8 @@ class Adafruit_Thermal(Serial):
 		self.charHeight    = 24
 		self.lineSpacing   =  6
 		self.barcodeHeight = 50
+		if self.codeTable is not None:
+			self.codeTable = codepageTable(0) # Reset to CP437
 		if self.firmwareVersion >= 264:
 			# Configure tab stops on recent printers
 			self.writeBytes(27, 68)         # Set tab stops
@@ -259,7 +1299,11 @@ class Adafruit_Thermal(Serial):
 		self.setBarcodeHeight(50)
 		self.setSize('s')
 		self.setCharset()
-		self.setCodePage()
+		# Code page 0, without turning on transcoding (see
+		# setCodePage()) if it isn't on already
+		self.writeBytes(27, 116, 0)
+		if self.codeTable is not None:
+			self.codeTable = codepageTable(0)
 
 	def test(self):
 		self.write("Hello world!")
@@ -340,21 +1384,13 @@ class Adafruit_Thermal(Serial):
 			# Recent firmware: write length byte + string sans NUL
 			n = len(text)
 			if n > 255: n = 255
-			if self.writeToStdout:
-				sys.stdout.write(chr(n))
-				for i in range(n):
-					sys.stdout.write(text[i])
-			else:
-				super(Adafruit_Thermal, self).write(chr(n))
-				for i in range(n):
-					super(Adafruit_Thermal,
-					  self).write(text[i])
+			self.writeRaw(bytearray([n]))
+			self.writeRaw(text[:n])
 		else:
 			# Older firmware: write string + NUL
-			if self.writeToStdout:
-				sys.stdout.write(text)
-			else:
-				super(Adafruit_Thermal, self).write(text)
+			self.writeRaw(text)
+		if self.metrics is not None:
+			self.metrics.count('barcode', len(text))
 		self.prevByte = '\n'
 
 	# === Character commands ===
@@ -463,11 +1499,18 @@ class Adafruit_Thermal(Serial):
 			while x > 0:
 				self.write('\n')
 				x -= 1
+		self.flushOutput() # Usually the end of a job
+
+	# Pushes out any output the transport is buffering (see
+	# StdoutSink).  This happens anyway after feed() and at exit.
+	def flushOutput(self):
+		if self.writer is None:
+			self.transport.flush()
 
 	# Feeds by the specified number of individual pixel rows
 	def feedRows(self, rows):
 		self.writeBytes(27, 74, rows)
-		self.timeoutSet(rows * dotFeedTime)
+		self.timeoutSet(rows * self.dotFeedTime)
 		self.prevByte = '\n'
 		self.column = 0
 
@@ -503,81 +1546,202 @@ class Adafruit_Thermal(Serial):
 	def underlineOff(self):
 		self.writeBytes(27, 45, 0)
 
-	def printBitmap(self, w, h, bitmap, LaaT=False):
-		rowBytes = (w + 7) / 8  # Round up to next byte boundary
+	# Bitmap may be any buffer-protocol object (bytes, bytearray,
+	# array, memoryview, NumPy array, etc.) and is sent in slices,
+	# one per chunk, without copying (unless it isn't contiguous, as
+	# with some NumPy slices, when it's copied once).  Anything else
+	# (such as the integer lists in gfx/*.py) is converted to a
+	# bytearray once.
+	# Runs of blank rows (at least minBlankRun of them) are skipped
+	# with a paper feed rather than printed, saving their bytes and
+	# the difference between print and feed time, unless elideBlank
+	# is False.  Chunks are broken at these runs, where any gap it
+	# leaves can't show.
+	def printBitmap(self, w, h, bitmap, LaaT=None):
+		rowBytes = (w + 7) // 8  # Round up to next byte boundary
 		if rowBytes >= 48:
 			rowBytesClipped = 48  # 384 pixels max width
 		else:
 			rowBytesClipped = rowBytes
 
+		try:
+			data = memoryview(bitmap)
+		except TypeError:
+			data = memoryview(bytearray(bitmap))
+		if not data.c_contiguous:
+			# Strided (e.g. a NumPy slice): can't be viewed as
+			# flat bytes, so take a compact copy once.
+			data = memoryview(data.tobytes())
+		elif data.ndim != 1 or data.itemsize != 1:
+			data = data.cast('B')
+
 		# if LaaT (line-at-a-time) is True, print bitmaps
 		# scanline-at-a-time (rather than in chunks).
 		# This tends to make for much cleaner printing
 		# (no feed gaps) on large images...but has the
 		# opposite effect on small images that would fit
-		# in a single 'chunk', so use carefully!
-		if LaaT: maxChunkHeight = 1
-		else:    maxChunkHeight = 255
-
-		i = 0
-		for rowStart in range(0, h, maxChunkHeight):
-			chunkHeight = h - rowStart
-			if chunkHeight > maxChunkHeight:
-				chunkHeight = maxChunkHeight
-
-			# Timeout wait happens here
-			self.writeBytes(18, 42, chunkHeight, rowBytesClipped)
-
-			for y in range(chunkHeight):
-				for x in range(rowBytesClipped):
-					if self.writeToStdout:
-						sys.stdout.write(
-						  chr(bitmap[i]))
-					else:
-						super(Adafruit_Thermal,
-						  self).write(chr(bitmap[i]))
-					i += 1
-				i += rowBytes - rowBytesClipped
-			self.timeoutSet(chunkHeight * self.dotPrintTime)
+		# in a single 'chunk'.  False forces the largest
+		# chunks.  The default (None) picks chunk sizes to
+		# suit the image; see chunkHeights().
+		if LaaT:            maxChunkHeight = 1
+		elif LaaT is False: maxChunkHeight = 255
+		else:               maxChunkHeight = None
+
+		if self.elideBlank:
+			runs = blankRuns(data, h, rowBytes, rowBytesClipped,
+			  self.minBlankRun)
+		else:
+			runs = []
+
+		chunks = 0
+		rows   = 0
+		y      = 0
+		for blankStart, blankEnd in runs + [(h, h)]:
+			# Print rows y through blankStart - 1...
+			if maxChunkHeight is None:
+				heights = self.chunkHeights(data, y, blankStart,
+				  rowBytes, rowBytesClipped)
+			else:
+				heights = [min(blankStart - r, maxChunkHeight)
+				  for r in range(y, blankStart, maxChunkHeight)]
+			rowStart = y
+			for chunkHeight in heights:
+				# Timeout wait happens here
+				self.writeBytes(18, 42, chunkHeight,
+				  rowBytesClipped)
+
+				i = rowStart * rowBytes
+				n = chunkHeight * rowBytes
+				if rowBytes == rowBytesClipped:
+					self.writeRaw(data[i:i + n])
+				else:
+					# Source is wider than the printer: send
+					# the leftmost 48 bytes of each row.
+					for r in range(i, i + n, rowBytes):
+						self.writeRaw(
+						  data[r:r + rowBytesClipped])
+				if self.inkBase < 1.0:
+					ink = bandInk(data, rowStart, chunkHeight,
+					  rowBytes, rowBytesClipped)
+				else:
+					ink = None
+				self.timeoutSet(self.bitmapTime(chunkHeight, ink))
+				if self.tuner is not None: self.tuner.check(self)
+				chunks   += 1
+				rows     += chunkHeight
+				rowStart += chunkHeight
+
+			# ...then feed past the blank run
+			for rowStart in range(blankStart, blankEnd, 255):
+				self.feedRows(min(blankEnd - rowStart, 255))
+			y = blankEnd
 
 		self.prevByte = '\n'
+		if self.metrics is not None:
+			self.metrics.count('bitmap', rows * rowBytesClipped)
+			self.metrics.chunks += chunks
+
+	# Estimated time to print 'rows' rows of bitmap holding 'ink' black
+	# dots in all.  The printer heats up to inkFull dots at a time (96
+	# as set by initialize()), so a row with that many or more takes
+	# the full dotPrintTime; sparser rows take less, down to inkBase
+	# times dotPrintTime for a blank one.  The rows' average is used,
+	# which never comes out below the sum of per-row times.  inkBase =
+	# 1.0 (the default, or ink = None) charges every row the full time.
+	# That's the safe choice: sparse rows print quicker only on some
+	# printers and at some heat settings, and if the model promises
+	# more than the printer delivers, its input buffer overflows on
+	# long sparse bitmaps.  Enable it with setInkModel(), with a base
+	# confirmed on the printer at hand (or use adaptive timing).
+	def bitmapTime(self, rows, ink=None):
+		if ink is None or self.inkBase >= 1.0:
+			return rows * self.dotPrintTime
+		full = min(1.0, ink / float(rows * self.inkFull))
+		return rows * self.dotPrintTime * (
+		  self.inkBase + (1.0 - self.inkBase) * full)
+
+	# Sets the ink density time model (see bitmapTime()): 'base' is the
+	# time for a blank row as a fraction of dotPrintTime, and 'full'
+	# the number of black dots in a row from which it takes the full
+	# time; e.g. setInkModel(0.5).  setInkModel(1.0) goes back to the
+	# full time for all rows.
+	def setInkModel(self, base, full=96):
+		self.inkBase = base
+		self.inkFull = full
+
+	# Chunk heights for printing rows 'start' through 'end' - 1 of a
+	# bitmap.  Rows that fit in the printer's input buffer (bufferSize
+	# bytes) all at once go as one chunk: no gaps, least overhead.
+	# Anything taller is split into chunks of up to half the buffer, so
+	# one can arrive while the last prints, in bands whose height also
+	# shrinks with ink density -- dense rows print slowly (the printer
+	# heats only so many dots at once), and a smaller chunk keeps the
+	# printer's workload, and its pause at the chunk's end, short.  A
+	# solid black band gets chunks a quarter the height of a blank one.
+	def chunkHeights(self, data, start, end, rowBytes, clipped):
+		h = end - start
+		if h <= 255 and h * clipped <= self.bufferSize:
+			return [h] if h > 0 else []
+		base    = max(1, min(255, self.bufferSize // (2 * clipped)))
+		heights = []
+		y       = start
+		while y < end:
+			n = min(base, end - y)
+			ink     = bandInk(data, y, n, rowBytes, clipped)
+			density = ink / (8.0 * clipped * n)
+			n = min(max(1, int(base / (1 + 3 * density))), end - y)
+			rest = end - y - n
+			if rest <= n // 4 and n + rest <= base:
+				n += rest # Not worth a chunk of its own
+			heights.append(n)
+			y += n
+		return heights
 
 	# Print Image.  Requires Python Imaging Library.  This is
 	# specific to the Python port and not present in the Arduino
 	# library.  Image will be cropped to 384 pixels width if
-	# necessary, and converted to 1-bit w/diffusion dithering.
+	# necessary, and converted to 1-bit w/dithering.
 	# For any other behavior (scale, B&W threshold, etc.), use
 	# the Imaging Library to perform such operations before
-	# passing the result to this function.
-	def printImage(self, image, LaaT=False):
-		from PIL import Image
-
-		if image.mode != '1':
-			image = image.convert('1')
-
-		width  = image.size[0]
-		height = image.size[1]
-		if width > 384:
-			width = 384
-		rowBytes = (width + 7) / 8
-		bitmap   = bytearray(rowBytes * height)
-		pixels   = image.load()
-
-		for y in range(height):
-			n = y * rowBytes
-			x = 0
-			for b in range(rowBytes):
-				sum = 0
-				bit = 128
-				while bit > 0:
-					if x >= width: break
-					if pixels[x, y] == 0:
-						sum |= bit
-					x    += 1
-					bit >>= 1
-				bitmap[n + b] = sum
-
-		self.printBitmap(width, height, bitmap, LaaT)
+	# passing the result to this function.  'image' may also be
+	# a filename.  If the printer has a rasterCache, files (and
+	# images fresh from Image.open()) are packed only once.
+	# 'dither' selects the 1-bit conversion: 'floyd' (default),
+	# 'threshold', 'bayer' or 'atkinson' (see ditherImage()).  With
+	# 'fit' True, the image is scaled to the full 384 pixel width
+	# rather than cropped.  Images taller than tileHeight rows are
+	# converted and printed a tile at a time (see imageTiles()), the
+	# next tile being converted while the current one prints, up to
+	# prefetchBands tiles ahead (0 converts each tile only once the
+	# previous one is sent).
+	def printImage(self, image, LaaT=None, dither='floyd', fit=False):
+		if (self.rasterCache is not None and
+		    self.rasterCache.cacheable(image)):
+			width, height, bitmap = self.rasterCache.pack(image,
+			  dither, fit=fit)
+			self.printBitmap(width, height, bitmap, LaaT)
+		else:
+			if isinstance(image, str):
+				from PIL import Image
+				image = Image.open(image)
+			tiles = imageTiles(image, 384, fit, dither,
+			  self.tileHeight)
+			if self.prefetchBands > 0:
+				tiles = prefetch(tiles, self.prefetchBands)
+			for width, height, bitmap in tiles:
+				self.printBitmap(width, height, bitmap, LaaT)
+		if self.metrics is not None: self.metrics.images += 1
+
+	# Prints text rendered with TrueType fonts rather than the
+	# printer's own, as bitmaps a line at a time, for scripts and
+	# symbols the printer can't print.  'font' is a RasterFont (see
+	# RasterText.py), which does the wrapping and rendering; 'align'
+	# is 'L', 'C' or 'R'.
+	def printRasterText(self, text, font, align='L'):
+		for width, height, bitmap in font.lines(text, align):
+			self.printBitmap(width, height, bitmap)
+			if font.lineSpacing > 0:
+				self.feedRows(font.lineSpacing)
 
 	# Take the printer offline. Print commands sent after this
 	# will be ignored until 'online' is called.
@@ -604,7 +1768,7 @@ class Adafruit_Thermal(Serial):
 		self.timeoutSet(0)
 		self.writeBytes(255)
 		if self.firmwareVersion >= 264:
-			time.sleep(0.05)            # 50 ms
+			self.timeoutSet(0.05)       # 50 ms
 			self.writeBytes(27, 118, 0) # Sleep off (important!)
 		else:
 			for i in range(10):
@@ -620,12 +1784,16 @@ class Adafruit_Thermal(Serial):
 	# ability. Doesn't match the datasheet...
 	# Returns True for paper, False for no paper.
 	def hasPaper(self):
+		start = clock()
 		if self.firmwareVersion >= 264:
 			self.writeBytes(27, 118, 0)
 		else:
 			self.writeBytes(29, 114, 0)
+		self.flushQueue()
 		# Bit 2 of response seems to be paper status
-		stat = ord(self.read(1)) & 0b00000100
+		stat = ord(self.transport.read(1)) & 0b00000100
+		if self.metrics is not None:
+			self.metrics.queries.observe(clock() - start)
 		# If set, we have paper; if clear, no paper
 		return stat == 0
 
@@ -707,10 +1875,20 @@ class Adafruit_Thermal(Serial):
 	CODEPAGE_CP856       = 46
 	CODEPAGE_CP874       = 47
 
-	# Selects alt symbols for 'upper' ASCII values 0x80-0xFF
+	# Selects code page 'val' (one of the CODEPAGE_* values) for the
+	# characters 128-255.  From then on, text passed to write() and
+	# printWrapped() is transcoded to that page (see codepageTable()),
+	# so Unicode text prints as the printer's own glyphs where it has
+	# them and as ASCII approximations where it doesn't.  Until a code
+	# page is selected this way, text is sent as-is (characters 128-255
+	# as the bytes of the same value); setDefault() and reset() don't
+	# turn transcoding on.  Byte strings (bytes or bytearray, or str on
+	# Python 2) are never transcoded: for raw glyph codes, e.g. the
+	# degree sign in code page 437, use write(b'\xf8').
 	def setCodePage(self, val=0):
 		if val > 47: val = 47
 		self.writeBytes(27, 116, val)
+		self.codeTable = codepageTable(val)
 
 	# Copied from Arduino lib for parity; may not work on all printers
 	def tab(self):
@@ -734,3 +1912,151 @@ class Adafruit_Thermal(Serial):
 			self.write(str(arg))
 		self.write('\n')
 
+	# Prints a paragraph (or several, separated by newlines) word
+	# wrapped to the line width for the current size and print mode,
+	# aligned per 'align' and 'pad' (see wrapText()).  Continues from
+	# the current column, and ends with a newline, as println() does.
+	# Each line goes to the printer as a whole, with its print time
+	# figured once, so this is also quicker than write() for long text.
+	def printWrapped(self, text, align='L', pad=False):
+		if isinstance(text, (bytes, bytearray)) and (
+		  not isinstance(text, str)):
+			text = bytes(text).decode('latin-1') # As-is; see write()
+		elif not isinstance(text, (str, type(u''))):
+			text = str(text)
+		elif self.codeTable is not None and isinstance(text,
+		  type(u'')):
+			text = text.translate(self.codeTable)
+		if self.metrics is not None:
+			self.metrics.count('text', len(text))
+		indent = min(self.column, self.maxColumn)
+		lines  = wrapText(text, self.maxColumn, align.upper(), pad,
+		  indent)
+		for line in lines:
+			# A line filling the width wraps by itself (but a line
+			# in progress already past it, as after switching to
+			# double width, never wraps; see write())
+			if (indent + len(line) < self.maxColumn or
+			    self.column > self.maxColumn):
+				line += '\n'
+			if self.writeToStdout:
+				self.writeRaw(line)
+				continue
+			d = len(line) * self.byteTime
+			if self.column == 0 and line == '\n':
+				# Feed line (blank)
+				d += ((self.charHeight + self.lineSpacing) *
+				      self.dotFeedTime)
+			else:
+				# Text line
+				d += ((self.charHeight * self.dotPrintTime) +
+				      (self.lineSpacing * self.dotFeedTime))
+			self.timeoutWait()
+			self.writeRaw(line)
+			self.timeoutSet(d)
+			if self.tuner is not None: self.tuner.check(self)
+			self.column   = 0
+			self.prevByte = '\n'
+			indent        = 0
+
+	# Sends a PrintJob (see below) recorded earlier, reproducing its
+	# pacing: data between timing events goes out in single writes.
+	# The printer then picks up the job's text state (column, print
+	# mode, etc.) as it stood at the end of the job.
+	def printJob(self, job):
+		metrics = self.metrics
+		if metrics is not None:
+			# Job duration runs from when its first byte is sent to
+			# when the printer's expected to be done with it; with
+			# threaded output, that's when the writer gets to it.
+			estimate = job.estimatedTime()
+			start    = [clock()]
+			if self.writer is not None:
+				self.queueEvent(lambda: start.__setitem__(0, clock()))
+			metrics.count('job', len(job.data))
+		data = memoryview(job.data)
+		pos  = 0
+		for offset, x in job.timing:
+			if offset > pos:
+				self.writeRaw(data[pos:offset])
+				pos = offset
+			if x is None: self.timeoutWait()
+			else:         self.timeoutSet(x)
+		if pos < len(data):
+			self.writeRaw(data[pos:])
+		for attr in PrintJob.state:
+			setattr(self, attr, getattr(job, attr))
+		if metrics is not None:
+			done = lambda: metrics.job(estimate,
+			  max(clock(), self.resumeTime) - start[0])
+			if self.writer is not None: self.queueEvent(done)
+			else:                       done()
+
+# A PrintJob has the same API as Adafruit_Thermal (println, boldOn,
+# printBitmap, printBarcode, feed...), but rather than talking to the
+# printer, it records the output in a bytearray ('data') along with a
+# parallel list of timing events ('timing'): (offset, seconds) where
+# the driver would set a timeout after that many bytes, or (offset,
+# None) where it would wait for the last one to expire.  Jobs can be
+# built ahead of time or on another thread while the printer is busy,
+# then sent with printer.printJob(job).
+#
+# Pass the printer the job is intended for, so that the job starts
+# from its current text state and uses its firmware version and print
+# and feed timing; otherwise library defaults are used.
+class PrintJob(Adafruit_Thermal):
+
+	# Attributes tracking text state, carried from the printer into
+	# the job and back out again when it's printed.
+	state = ('prevByte', 'column', 'maxColumn', 'charHeight',
+	  'lineSpacing', 'barcodeHeight', 'printMode', 'codeTable')
+
+	def __init__(self, printer=None):
+		self.transport = Transport() # Unused; see writeRaw()
+		self.data   = bytearray()
+		self.timing = []
+		if printer is None:
+			self.byteTime     = 11.0 / 19200
+			self.dotPrintTime = 0.03
+			self.dotFeedTime  = 0.0021
+			self.lineSpacing  = 6
+		else:
+			self.firmwareVersion = printer.firmwareVersion
+			self.byteTime        = printer.byteTime
+			self.dotPrintTime    = printer.dotPrintTime
+			self.dotFeedTime     = printer.dotFeedTime
+			self.rasterCache     = printer.rasterCache
+			self.elideBlank      = printer.elideBlank
+			self.bufferSize      = printer.bufferSize
+			self.tileHeight      = printer.tileHeight
+			self.prefetchBands   = printer.prefetchBands
+			self.inkBase         = printer.inkBase
+			self.inkFull         = printer.inkFull
+			for attr in self.state:
+				setattr(self, attr, getattr(printer, attr))
+
+	def writeRaw(self, data):
+		if isinstance(data, type(u'')):
+			data = data.encode('latin-1')
+		self.data += data
+
+	def timeoutSet(self, x):
+		self.timing.append((len(self.data), x))
+
+	def timeoutWait(self):
+		# Consecutive waits with nothing between them are redundant
+		if self.timing and self.timing[-1] == (len(self.data), None):
+			return
+		self.timing.append((len(self.data), None))
+
+	# Estimated time (seconds) for the printer to complete the job,
+	# per the same timing model used by the live driver.
+	def estimatedTime(self):
+		t      = 0.0
+		resume = 0.0
+		for offset, x in self.timing:
+			if x is None:
+				if resume > t: t = resume
+			else:
+				resume = t + x
+		return max(t, resume)
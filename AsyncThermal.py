@@ -0,0 +1,164 @@
+#*************************************************************************
+# asyncio front end for the Adafruit_Thermal library (Python 3 only).
+#
+# The regular driver blocks its caller for as long as the printer is
+# busy, which for an image can be several seconds -- a problem for
+# programs that also poll feeds, watch buttons, etc.  AsyncThermal has
+# the same methods as Adafruit_Thermal, but each is a coroutine: the
+# command is encoded as usual (by a PrintJob), then sent through the
+# event loop to a non-blocking serial file descriptor, awaiting the
+# printer's estimated completion time (resumeTime) between writes
+# rather than blocking.  Images, bitmaps and raster text are converted
+# and encoded on an executor thread, so the loop keeps running then too.
+#
+# Usage:
+#   printer = AsyncThermal("/dev/serial0", 19200)
+#   await printer.println("Hello world!")
+#   await printer.printImage(Image.open('gfx/hello.png'))
+#
+# An open file descriptor (e.g. one end of a pty pair, for testing
+# without a printer) may be passed instead of a port name.
+#
+# MIT license, all text above must be included in any redistribution.
+#*************************************************************************
+
+from Adafruit_Thermal import *
+import asyncio
+import functools
+import os
+
+class AsyncThermal(object):
+
+	def __init__(self, port, baudrate=19200, firmware=268,
+	  heattime=Adafruit_Thermal.defaultHeatTime):
+		if isinstance(port, int):
+			self.serial = None
+			self.fd     = port
+		else:
+			self.serial = Serial(port, baudrate)
+			self.fd     = self.serial.fileno()
+		os.set_blocking(self.fd, False)
+
+		# Commands are encoded into 'job' and sent (and the job
+		# emptied) by drain().  The job persists so text state
+		# (column, print mode, etc.) carries through.
+		self.job                 = PrintJob()
+		self.job.firmwareVersion = firmware
+		self.job.byteTime        = 11.0 / float(baudrate)
+		self.resumeTime          = 0.0
+		self.lock                = asyncio.Lock()
+		self.job.initialize(heattime)
+
+	# Any other attribute is looked up in the job: command methods
+	# become coroutines that record the command, then send it; the
+	# rest (constants, column, etc.) are returned as-is.
+	def __getattr__(self, name):
+		if name == 'job': raise AttributeError(name)
+		attr = getattr(self.job, name)
+		if not callable(attr) or isinstance(attr, type):
+			return attr
+		@functools.wraps(attr)
+		async def command(*args, **kwargs):
+			result = attr(*args, **kwargs)
+			await self.drain()
+			return result
+		return command
+
+	# Sends everything recorded in the job so far, following its
+	# timing events: sleeps until resumeTime wherever the driver would
+	# wait, and writes the data between events in single writes.
+	async def drain(self):
+		async with self.lock:
+			data   = memoryview(bytes(self.job.data))
+			timing = self.job.timing
+			self.job.data   = bytearray()
+			self.job.timing = []
+			pos = 0
+			for offset, x in timing:
+				if offset > pos:
+					await self.send(data[pos:offset])
+					pos = offset
+				if x is None: await self.finish()
+				else:         self.resumeTime = clock() + x
+			if pos < len(data):
+				await self.send(data[pos:])
+
+	# Runs command 'name' recording into a copy of the job, on an
+	# executor thread, then adds what it recorded to the job and sends
+	# it.  For commands slow enough to stall the event loop (image
+	# conversion and dithering, bitmap packing, glyph rendering).
+	async def offload(self, name, *args, **kwargs):
+		job  = PrintJob(self.job)
+		loop = asyncio.get_running_loop()
+		await loop.run_in_executor(None, functools.partial(
+		  getattr(job, name), *args, **kwargs))
+		self.job.printJob(job)
+		await self.drain()
+
+	async def printImage(self, image, LaaT=None, dither='floyd',
+	  fit=False):
+		await self.offload('printImage', image, LaaT, dither, fit)
+
+	async def printBitmap(self, w, h, bitmap, LaaT=None):
+		await self.offload('printBitmap', w, h, bitmap, LaaT)
+
+	async def printRasterText(self, text, font, align='L'):
+		await self.offload('printRasterText', text, font, align)
+
+	# Waits (if necessary) for the printer to complete the task in
+	# progress, per the estimated resume time.
+	async def finish(self):
+		delay = self.resumeTime - clock()
+		if delay > 0:
+			await asyncio.sleep(delay)
+
+	# Writes data to the descriptor, yielding to the event loop
+	# whenever it can't take any more.
+	async def send(self, data):
+		loop = asyncio.get_running_loop()
+		while len(data):
+			try:
+				data = data[os.write(self.fd, data):]
+			except BlockingIOError:
+				ready = loop.create_future()
+				loop.add_writer(self.fd, ready.set_result, None)
+				try:
+					await ready
+				finally:
+					loop.remove_writer(self.fd)
+
+	# Reads n bytes from the descriptor without blocking the loop.
+	async def read(self, n=1):
+		loop = asyncio.get_running_loop()
+		data = b''
+		while len(data) < n:
+			try:
+				chunk = os.read(self.fd, n - len(data))
+			except BlockingIOError:
+				chunk = None
+			if chunk:
+				data += chunk
+				continue
+			ready = loop.create_future()
+			loop.add_reader(self.fd, ready.set_result, None)
+			try:
+				await ready
+			finally:
+				loop.remove_reader(self.fd)
+		return data
+
+	# Same as Adafruit_Thermal.hasPaper(), but the reply is awaited.
+	async def hasPaper(self):
+		if self.job.firmwareVersion >= 264:
+			self.job.writeBytes(27, 118, 0)
+		else:
+			self.job.writeBytes(29, 114, 0)
+		await self.drain()
+		stat = (await self.read(1))[0] & 0b00000100
+		return stat == 0
+
+	def close(self):
+		if self.serial is not None:
+			self.serial.close()
+		else:
+			os.close(self.fd)
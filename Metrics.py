@@ -0,0 +1,183 @@
+#*************************************************************************
+# Runtime metrics for Adafruit_Thermal, for long-running printer daemons.
+#
+# Pass a Metrics registry to the driver and it keeps count of:
+# - bytes sent, per command type ('ESC d', 'DC2 *', 'GS k'...), with
+#   text, bitmap data, barcode data and PrintJob data counted as
+#   'text', 'bitmap', 'barcode' and 'job';
+# - time blocked in timeoutWait() waiting out the printer (histogram);
+# - bitmap chunks and images printed;
+# - status query latency, i.e. hasPaper() and TimingTuner queries,
+#   from query to reply (histogram);
+# - estimated vs. wall-clock duration of printJob() jobs (histograms);
+#   wall-clock time runs from the first byte of the job being sent to
+#   the printer's completion time as estimated at the end, so it
+#   includes any time the port spent blocked and any pacing lag.
+# Everything is plain counters updated in place, so the cost on the
+# driver's write path is a few dictionary and attribute updates.  A
+# registry is meant for one printer: updates aren't locked, and with
+# threaded output some happen on the writer thread.
+#
+# The registry can be written out in Prometheus text format, for the
+# node exporter's textfile collector:
+#   metrics = Metrics(labels={'printer': 'serial0'})
+#   printer = Adafruit_Thermal("/dev/serial0", 19200, timeout=5,
+#     metrics=metrics)
+#   metrics.startDump('/var/lib/node_exporter/thermal.prom', 60)
+# Use writeTextfile() to write several printers' registries to one file.
+#
+# MIT license, all text above must be included in any redistribution.
+#*************************************************************************
+
+from __future__ import print_function
+import threading
+import bisect
+import os
+
+# Histogram with fixed bucket upper bounds (seconds), in the cumulative
+# form Prometheus expects only when written out.
+class Histogram(object):
+
+	def __init__(self, buckets):
+		self.buckets = buckets
+		self.counts  = [0] * (len(buckets) + 1) # Last is +Inf
+		self.sum     = 0.0
+		self.count   = 0
+
+	def observe(self, value):
+		self.counts[bisect.bisect_left(self.buckets, value)] += 1
+		self.sum   += value
+		self.count += 1
+
+	def samples(self, name, labels):
+		total = 0
+		for le, n in zip(self.buckets + [float('inf')], self.counts):
+			total += n
+			yield ('%s_bucket' % name,
+			  labels + [('le', '+Inf' if le == float('inf') else
+			  repr(le))], total)
+		yield ('%s_sum' % name, labels, self.sum)
+		yield ('%s_count' % name, labels, self.count)
+
+waitBuckets  = [0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0]
+queryBuckets = [0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 2.0, 5.0]
+jobBuckets   = [0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0]
+
+# Leading bytes of ESC/POS commands, for naming command types.
+prefixes = { 27: 'ESC', 29: 'GS', 18: 'DC2' }
+
+class Metrics(object):
+
+	def __init__(self, labels=None):
+		self.labels       = sorted((labels or {}).items())
+		self.bytes        = {}
+		self.commands     = {}   # Command type names, by leading bytes
+		self.chunks       = 0
+		self.images       = 0
+		self.waits        = Histogram(waitBuckets)
+		self.queries      = Histogram(queryBuckets)
+		self.jobEstimated = Histogram(jobBuckets)
+		self.jobWall      = Histogram(jobBuckets)
+		self.dumper       = None
+
+	# Counts 'n' bytes of type 'kind'.
+	def count(self, kind, n):
+		self.bytes[kind] = self.bytes.get(kind, 0) + n
+
+	# Counts the bytes of a command issued via writeBytes().
+	def command(self, args):
+		key  = args[:2]
+		kind = self.commands.get(key)
+		if kind is None:
+			if args[0] in prefixes and len(args) > 1:
+				c = args[1]
+				kind = '%s %s' % (prefixes[args[0]],
+				  chr(c) if 32 < c < 127 else c)
+			else:
+				kind = 'control'
+			self.commands[key] = kind
+		self.bytes[kind] = self.bytes.get(kind, 0) + len(args)
+
+	def job(self, estimated, wall):
+		self.jobEstimated.observe(estimated)
+		self.jobWall.observe(wall)
+
+	# (name, type, help, samples) for each metric.
+	def metrics(self):
+		labels = self.labels
+		return [
+		  ('thermal_bytes_total', 'counter',
+		    'Bytes sent to the printer, by command type',
+		    [('thermal_bytes_total', labels + [('command', kind)], n)
+		     for kind, n in sorted(self.bytes.copy().items())]),
+		  ('thermal_bitmap_chunks_total', 'counter',
+		    'Bitmap chunks (DC2 * commands) sent',
+		    [('thermal_bitmap_chunks_total', labels, self.chunks)]),
+		  ('thermal_images_total', 'counter', 'Images printed',
+		    [('thermal_images_total', labels, self.images)]),
+		  ('thermal_wait_seconds', 'histogram',
+		    'Time blocked waiting for the printer',
+		    list(self.waits.samples('thermal_wait_seconds', labels))),
+		  ('thermal_status_query_seconds', 'histogram',
+		    'Status query latency, from query to reply',
+		    list(self.queries.samples(
+		      'thermal_status_query_seconds', labels))),
+		  ('thermal_job_estimated_seconds', 'histogram',
+		    'Print job duration per the timing model',
+		    list(self.jobEstimated.samples(
+		      'thermal_job_estimated_seconds', labels))),
+		  ('thermal_job_wall_seconds', 'histogram',
+		    'Print job duration by the wall clock',
+		    list(self.jobWall.samples(
+		      'thermal_job_wall_seconds', labels))) ]
+
+	def text(self):
+		return textfile([self])
+
+	def dump(self, path):
+		writeTextfile(path, [self])
+
+	# Dumps to 'path' every 'interval' seconds, from a background
+	# thread, until stopDump().
+	def startDump(self, path, interval=60.0):
+		self.stopDump()
+		stop = threading.Event()
+		def run():
+			while not stop.wait(interval):
+				self.dump(path)
+		self.dumper = (threading.Thread(target=run), stop)
+		self.dumper[0].daemon = True
+		self.dumper[0].start()
+
+	def stopDump(self):
+		if self.dumper is None: return
+		self.dumper[1].set()
+		self.dumper[0].join()
+		self.dumper = None
+
+def formatLabels(labels):
+	if not labels: return ''
+	return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\',
+	  '\\\\').replace('"', '\\"')) for k, v in labels)
+
+# Prometheus text format for a list of registries (e.g. one per
+# printer, told apart by their labels), each metric described once.
+def textfile(registries):
+	lines   = []
+	metrics = [r.metrics() for r in registries]
+	for i, (name, kind, help, samples) in enumerate(metrics[0]):
+		lines.append('# HELP %s %s' % (name, help))
+		lines.append('# TYPE %s %s' % (name, kind))
+		for m in metrics:
+			for sample, labels, value in m[i][3]:
+				lines.append('%s%s %s' %
+				  (sample, formatLabels(labels), repr(value)))
+	return '\n'.join(lines) + '\n'
+
+# Writes the registries' metrics to 'path', atomically (the textfile
+# collector may read it at any moment).
+def writeTextfile(path, registries):
+	tmp = '%s.%d.tmp' % (path, os.getpid())
+	with open(tmp, 'w') as f:
+		f.write(textfile(registries))
+	os.rename(tmp, path)
@@ -0,0 +1,97 @@
+#*************************************************************************
+# Dispatcher for several Adafruit_Thermal printers run from one host.
+#
+# A PrinterFarm owns a set of printers, each in threaded output mode
+# (see Adafruit_Thermal.startWriter()) so all of them print at once.
+# Work is submitted as PrintJobs; each goes to whichever printer will
+# be free soonest, going by the job estimates of the driver's own
+# timing model, so long and short jobs balance out across the farm.
+# Throughput therefore grows with the number of printers, and the
+# submitting thread only blocks if every printer's queue is full.
+#
+# Usage:
+#   farm = PrinterFarm([
+#     Adafruit_Thermal("/dev/ttyUSB0", 19200, timeout=5),
+#     Adafruit_Thermal("/dev/ttyUSB1", 19200, timeout=5) ])
+#   job = farm.newJob()
+#   job.println("Hello world!")
+#   job.feed(2)
+#   farm.submit(job)
+#   ...
+#   farm.flush()
+#   print(farm.report())
+#
+# MIT license, all text above must be included in any redistribution.
+#*************************************************************************
+
+from __future__ import print_function
+from Adafruit_Thermal import *
+import threading
+
+class PrinterFarm(object):
+
+	def __init__(self, printers, queueSize=262144):
+		self.printers = list(printers)
+		n = len(self.printers)
+		if n == 0:
+			raise ValueError('PrinterFarm needs at least one printer')
+		for p in self.printers:
+			p.startWriter(queueSize) # No-op if already threaded
+		self.lock   = threading.Lock()
+		# Per-printer locks keep jobs sent to the same printer from
+		# different threads from interleaving.
+		self.locks  = [threading.Lock() for p in self.printers]
+		self.start  = clock()
+		self.freeAt = [self.start] * n # Estimated completion times
+		self.busy   = [0.0] * n        # Estimated seconds of work
+		self.jobs   = [0] * n
+		self.bytes  = [0] * n
+
+	# A new, empty PrintJob with the farm's timing and firmware (all
+	# printers are assumed alike; that of the first one is used).
+	def newJob(self):
+		return PrintJob(self.printers[0])
+
+	# Queues a job on the printer that will be free soonest, returning
+	# that printer's index.  Returns as soon as the job is queued.
+	# Ties (e.g. all printers idle, or jobs estimated to take no time)
+	# go to the printer sent the fewest bytes, then the fewest jobs.
+	def submit(self, job):
+		t = job.estimatedTime()
+		with self.lock:
+			now = clock()
+			i   = min(range(len(self.printers)),
+			  key=lambda i: (max(self.freeAt[i], now), self.bytes[i],
+			  self.jobs[i]))
+			self.freeAt[i] = max(self.freeAt[i], now) + t
+			self.busy[i]  += t
+			self.jobs[i]  += 1
+			self.bytes[i] += len(job.data)
+		with self.locks[i]:
+			self.printers[i].printJob(job)
+		return i
+
+	# Waits until every printer has sent everything queued.
+	def flush(self):
+		for p in self.printers:
+			p.flushQueue()
+
+	# Estimated fraction of the time since the farm started that each
+	# printer has been (or, with jobs still queued, will have been)
+	# busy printing.
+	def utilization(self):
+		elapsed = max(max(self.freeAt), clock()) - self.start
+		if elapsed <= 0: return [0.0] * len(self.printers)
+		return [b / elapsed for b in self.busy]
+
+	# Per-printer summary of jobs, bytes and utilization, one line each.
+	def report(self):
+		return '\n'.join(
+		  'printer %d: %d jobs, %d bytes, %.1f s busy, %.0f%% utilized' %
+		  (i, self.jobs[i], self.bytes[i], self.busy[i], u * 100)
+		  for i, u in enumerate(self.utilization()))
+
+	# Sends anything queued, then closes all printers.
+	def close(self):
+		for p in self.printers:
+			p.close()
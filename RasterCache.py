@@ -0,0 +1,159 @@
+#*************************************************************************
+# Persistent cache of printer-ready rasters for Adafruit_Thermal.
+#
+# Opening, dithering and packing an image takes far longer than
+# sending the result, and scripts that print fixed artwork (greeting
+# and goodbye images in main.py, logos, etc.) repeat that work every
+# time.  RasterCache keeps the packed rows on disk, so printing cached
+# art costs only the serial transmission.
+#
+# Entries are content-addressed: the key is a hash of the source file
+# plus the conversion (dither mode, scaling) and raster width, so identical
+# images share an entry and an edited image never matches a stale one.
+# Source hashes are remembered per file path along with its mtime and
+# size, so a file is only re-hashed when it changes.  The cache is
+# bounded in size; least-recently-used entries are evicted first.
+#
+# Usage:
+#   printer = Adafruit_Thermal("/dev/serial0", 19200, timeout=5,
+#     rasterCache=RasterCache())
+#   printer.printImage(Image.open('gfx/hello.png'))
+#
+# Only images straight from a file qualify: printImage() also accepts
+# a path, or an Image from Image.open() that hasn't been loaded (and so
+# can't have been modified).  Anything else is packed as usual.
+#
+# MIT license, all text above must be included in any redistribution.
+#*************************************************************************
+
+from __future__ import print_function
+from Adafruit_Thermal import imageTiles
+import hashlib
+import json
+import os
+import struct
+
+# Entry file header: raster width and height.  (Version 1 entries had
+# 16-bit fields, too small for long strips; the '-2' in entry names
+# keeps them from being read as version 2.)
+header = struct.Struct('<II')
+
+class RasterCache(object):
+
+	def __init__(self, directory=None, maxBytes=8 * 1024 * 1024):
+		if directory is None:
+			directory = os.path.join(os.path.expanduser('~'),
+			  '.cache', 'Adafruit_Thermal')
+		self.directory = directory
+		self.maxBytes  = maxBytes
+		self.hits      = 0
+		self.misses    = 0
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+		self.indexPath = os.path.join(directory, 'index.json')
+		try:
+			with open(self.indexPath) as f:
+				self.index = json.load(f)
+		except (IOError, ValueError):
+			self.index = {}
+
+	# Returns True if 'image' is a path, or an Image straight from
+	# Image.open() with its pixel data still unread.
+	@staticmethod
+	def cacheable(image):
+		if isinstance(image, str):
+			return True
+		return bool(getattr(image, 'filename', None) and
+		  getattr(image, 'tile', None))
+
+	# Hash of the file's contents, recomputed only if the file's
+	# mtime or size no longer match those recorded with the hash.
+	def sourceHash(self, path):
+		path = os.path.abspath(path)
+		st   = os.stat(path)
+		info = self.index.get(path)
+		if info and info[0] == st.st_mtime and info[1] == st.st_size:
+			return info[2]
+		h = hashlib.sha1()
+		with open(path, 'rb') as f:
+			for block in iter(lambda: f.read(65536), b''):
+				h.update(block)
+		self.index[path] = [st.st_mtime, st.st_size, h.hexdigest()]
+		self.saveIndex()
+		return h.hexdigest()
+
+	def saveIndex(self):
+		tmp = self.indexPath + '.tmp'
+		with open(tmp, 'w') as f:
+			json.dump(self.index, f)
+		os.rename(tmp, self.indexPath)
+
+	def entryPath(self, path, dither, width, fit=False):
+		key = '%s-%s-%d%s-2' % (self.sourceHash(path), dither, width,
+		  'fit' if fit else '')
+		return os.path.join(self.directory, key + '.raster')
+
+	# Returns (width, height, bitmap) for 'image' (a path or Image,
+	# see cacheable()), from the cache if possible, else packing it
+	# and storing the result.  'dither' names the 1-bit conversion,
+	# 'width' the maximum raster width and 'fit' whether the image is
+	# scaled to that width (see imageTiles()), all part of the key.
+	def pack(self, image, dither='floyd', width=384, fit=False):
+		if isinstance(image, str):
+			path = image
+		else:
+			path = image.filename
+		entry = self.entryPath(path, dither, width, fit)
+		try:
+			with open(entry, 'rb') as f:
+				data = f.read()
+			os.utime(entry, None) # Mark recently used
+			w, h = header.unpack(data[:header.size])
+			self.hits += 1
+			return w, h, memoryview(data)[header.size:]
+		except (IOError, OSError, struct.error):
+			pass
+
+		self.misses += 1
+		if isinstance(image, str):
+			from PIL import Image
+			image = Image.open(image)
+		# Packed a tile at a time, straight to the file, so a tall
+		# image never needs its whole raster in memory until read.
+		tmp   = entry + '.tmp'
+		total = 0
+		with open(tmp, 'wb') as f:
+			f.write(header.pack(0, 0))
+			for w, h, bitmap in imageTiles(image, width, fit, dither):
+				f.write(bitmap)
+				total += h
+			f.seek(0)
+			f.write(header.pack(w, total))
+		with open(tmp, 'rb') as f:
+			data = f.read()
+		os.rename(tmp, entry)
+		self.evict()
+		return w, total, memoryview(data)[header.size:]
+
+	# Removes least-recently-used entries until the cache is within
+	# its size limit.
+	def evict(self):
+		entries = []
+		total   = 0
+		for name in os.listdir(self.directory):
+			if not name.endswith('.raster'): continue
+			path = os.path.join(self.directory, name)
+			st   = os.stat(path)
+			entries.append((st.st_mtime, st.st_size, path))
+			total += st.st_size
+		entries.sort()
+		for mtime, size, path in entries:
+			if total <= self.maxBytes: break
+			os.remove(path)
+			total -= size
+
+	# Removes all entries.
+	def clear(self):
+		for name in os.listdir(self.directory):
+			os.remove(os.path.join(self.directory, name))
+		self.index = {}
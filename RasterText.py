@@ -0,0 +1,237 @@
+#*************************************************************************
+# TrueType text for Adafruit_Thermal, printed as bitmaps.
+#
+# The printer's built-in fonts cover only its code pages, so CJK,
+# Arabic, emoji and the like can't be printed as text.  A RasterFont
+# renders text with TrueType/OpenType fonts through PIL instead, a
+# line at a time, into 1-bit rows that printRasterText() prints with
+# printBitmap().  Characters missing from the first font are looked
+# up in the fallback fonts, in order, so one RasterFont can cover
+# mixed-script text (e.g. a Latin font, then a CJK one, then symbols).
+#
+# Each glyph is rasterized only once: glyphs are kept in an LRU cache
+# keyed by (font file, size, code point), shared by all RasterFonts,
+# and lines are composed by pasting cached glyphs, so repeated text
+# (receipt headers, recurring names) costs little after its first
+# appearance.  Since glyphs are placed one by one, there's no complex
+# script shaping (Arabic letters take their isolated forms) or
+# kerning; right-to-left runs are put in visual order, though.  Color
+# (bitmap-only) emoji fonts aren't supported; use an outline one.
+#
+# Usage:
+#   font = RasterFont('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+#     24, fallbacks=['/usr/share/fonts/opentype/noto/NotoSansCJK-'
+#     'Regular.ttc'])
+#   printer.printRasterText(u'Hello, 世界!', font)
+#
+# MIT license, all text above must be included in any redistribution.
+#*************************************************************************
+
+from __future__ import print_function
+from Adafruit_Thermal import packImage
+import collections
+import threading
+import unicodedata
+
+# A rasterized character: its advance width (pixels, fractional), its
+# image ('1' mode, 1 = ink; None if blank) with the offset of its top
+# left corner from the pen position on the baseline, and whether it's
+# the font's stand-in for a character it lacks.  Offsets don't depend
+# on the line's ascent, so RasterFonts with different fallbacks can
+# share cached glyphs.
+Glyph = collections.namedtuple('Glyph', 'advance image left top missing')
+
+class GlyphCache(object):
+
+	def __init__(self, maxGlyphs=4096):
+		self.maxGlyphs = maxGlyphs
+		self.glyphs    = collections.OrderedDict()
+		self.lock      = threading.Lock()
+		self.hits      = 0
+		self.misses    = 0
+
+	def get(self, key):
+		with self.lock:
+			glyph = self.glyphs.pop(key, None)
+			if glyph is None:
+				self.misses += 1
+			else:
+				self.glyphs[key] = glyph # Now most recent
+				self.hits += 1
+			return glyph
+
+	def put(self, key, glyph):
+		with self.lock:
+			self.glyphs[key] = glyph
+			while len(self.glyphs) > self.maxGlyphs:
+				self.glyphs.popitem(False)
+
+glyphCache = GlyphCache()
+
+# Unicode bidirectional classes set right to left, and those of
+# numbers (which read left to right even within right-to-left text).
+rtlClasses   = ('R', 'AL', 'AN')
+digitClasses = ('EN', 'AN')
+
+class RasterFont(object):
+
+	# 'path' and 'fallbacks' are font files (.ttf, .otf, .ttc), all used
+	# at 'size' pixels.  Lines are up to 'width' pixels wide, with
+	# 'lineSpacing' blank rows between them.
+	def __init__(self, path, size=24, fallbacks=(), width=384,
+	  lineSpacing=6, cache=None):
+		from PIL import ImageFont
+		self.paths       = [path] + list(fallbacks)
+		self.fonts       = [ImageFont.truetype(p, size)
+		                    for p in self.paths]
+		self.size        = size
+		self.width       = width
+		self.lineSpacing = lineSpacing
+		self.cache       = glyphCache if cache is None else cache
+		metrics          = [f.getmetrics() for f in self.fonts]
+		self.ascent      = max(a for a, d in metrics)
+		self.height      = self.ascent + max(d for a, d in metrics)
+		# Each font's rendering of a character it lacks (a noncharacter
+		# code point), for spotting missing glyphs: PIL can't tell if a
+		# font has a glyph, so any character rendered just the same (but
+		# for spaces) is taken to be missing.
+		self.notdef      = [self.render(f, u'\ufffe')
+		                    for f in self.fonts]
+
+	# Rasterizes character 'c' in 'font': (advance, image, left, top),
+	# image None if there's no ink.
+	def render(self, font, c):
+		from PIL import Image, ImageDraw
+		advance = font.getlength(c)
+		left, top, right, bottom = font.getbbox(c, anchor='ls')
+		if right <= left or bottom <= top:
+			return advance, None, 0, 0
+		image = Image.new('1', (right - left, bottom - top), 0)
+		ImageDraw.Draw(image).text((-left, -top), c, 1, font,
+		  anchor='ls')
+		return advance, image, left, top
+
+	# The glyph for character 'c', from the first font that has it (or
+	# the first font's stand-in if none does).
+	def glyph(self, c):
+		first = None
+		for i, font in enumerate(self.fonts):
+			key   = (self.paths[i], self.size, ord(c))
+			glyph = self.cache.get(key)
+			if glyph is None:
+				advance, image, left, top = self.render(font, c)
+				notdef  = self.notdef[i]
+				missing = (not c.isspace() and (advance, left,
+				  top) == (notdef[0], notdef[2], notdef[3]) and
+				  (image is None if notdef[1] is None else
+				   image is not None and image.size ==
+				   notdef[1].size and image.tobytes() ==
+				   notdef[1].tobytes()))
+				glyph = Glyph(advance, image, left, top, missing)
+				self.cache.put(key, glyph)
+			if not glyph.missing: return glyph
+			if first is None: first = glyph
+		return first
+
+	# Width of a string in pixels.
+	def measure(self, text):
+		return sum(self.glyph(c).advance for c in text)
+
+	# Word wraps a paragraph to the line width.  Breaks go at spaces,
+	# or between wide (CJK) characters, or anywhere in a word too long
+	# for a line.
+	def wrap(self, paragraph):
+		tokens = []
+		word   = u''
+		for c in paragraph:
+			if c == u' ' or unicodedata.east_asian_width(c) in 'WF':
+				if word: tokens.append(word)
+				tokens.append(c)
+				word = u''
+			else:
+				word += c
+		if word: tokens.append(word)
+
+		lines = []
+		line  = u''
+		for token in tokens:
+			if not line and token == u' ': continue # Leading space
+			if self.measure((line + token).rstrip()) <= self.width:
+				line += token
+				continue
+			if line.strip(): lines.append(line.rstrip())
+			line = u''
+			if token == u' ': continue
+			while self.measure(token) > self.width and len(token) > 1:
+				n = len(token) - 1
+				while n > 1 and self.measure(token[:n]) > self.width:
+					n -= 1
+				lines.append(token[:n])
+				token = token[n:]
+			line = token
+		lines.append(line.rstrip())
+		return lines
+
+	# Reorders a line for display: runs of right-to-left characters
+	# (with any spaces, digits or punctuation between them, and any
+	# number right after them) reversed, but for the numbers in them
+	# (with any separators between digits, as in 1,000.50), which
+	# keep their order.
+	@staticmethod
+	def visualOrder(line):
+		classes = [unicodedata.bidirectional(c) for c in line]
+		if not any(k in rtlClasses for k in classes): return line
+		out = list(line)
+		i   = 0
+		while i < len(line):
+			if classes[i] not in rtlClasses:
+				i += 1
+				continue
+			end = j = i
+			while j < len(line) and classes[j] not in ('L',):
+				if classes[j] in rtlClasses + digitClasses: end = j + 1
+				j += 1
+			out[i:end] = out[i:end][::-1]
+			k = i
+			while k < end:
+				if classes[k] not in digitClasses:
+					k += 1
+					continue
+				m = k + 1
+				while m < end and (classes[m] in digitClasses or
+				  classes[m] in ('ES', 'CS') and m + 1 < end and
+				  classes[m + 1] in digitClasses):
+					m += 1
+				a, b = i + end - m, i + end - k # Where k:m went
+				out[a:b] = out[a:b][::-1]
+				k = m
+			i = end
+		return u''.join(out)
+
+	# Composes one line as a '1' mode image, 0 (black) for ink, aligned
+	# per 'align' ('L', 'C' or 'R') and cropped to the rightmost ink.
+	def renderLine(self, line, align='L'):
+		from PIL import Image
+		line  = self.visualOrder(line)
+		space = self.width - self.measure(line)
+		x     = {'C': space / 2.0, 'R': space}.get(align.upper(), 0)
+		image = Image.new('1', (self.width, self.height), 1)
+		right = 0
+		for c in line:
+			glyph = self.glyph(c)
+			if glyph.image is not None:
+				pos = (int(round(x)) + glyph.left,
+				  self.ascent + glyph.top)
+				image.paste(0, pos, glyph.image)
+				right = max(right, pos[0] + glyph.image.size[0])
+			x += glyph.advance
+		right = min(max(8, (right + 7) & ~7), self.width)
+		return image.crop((0, 0, right, self.height))
+
+	# Lays out and renders text (paragraphs separated by newlines),
+	# yielding (width, height, bitmap) for each line, ready for
+	# printBitmap().
+	def lines(self, text, align='L'):
+		for paragraph in text.split(u'\n'):
+			for line in self.wrap(paragraph):
+				yield packImage(self.renderLine(line, align))
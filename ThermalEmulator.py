@@ -0,0 +1,460 @@
+#!/usr/bin/python
+
+#*************************************************************************
+# Virtual thermal printer, for developing and benchmarking programs that
+# use the Adafruit_Thermal library without the physical printer.
+#
+# The emulator opens a pseudo-terminal and reads from it as the printer
+# reads its serial line, interpreting the ESC/POS commands the library
+# sends (ESC @, ESC 7, DC2 #, DC2 *, ESC !, GS B, GS k, ESC d, ESC J and
+# the rest), and draws what the printer would print.  Speed is simulated
+# too: bytes are taken in no faster than the baud rate allows, into an
+# input buffer of limited size, and the buffer empties only as fast as
+# the print head and paper feed work through it.  Bytes arriving while
+# the buffer is full are lost, as on the real printer, and counted as
+# overruns -- a sign the driver is sending faster than the printer can
+# print.  Status queries are answered with 'paper present'.
+#
+# Usage:
+#   python ThermalEmulator.py [-o output.png] [-b 19200]
+# then point the driver at the port name it prints:
+#   printer = Adafruit_Thermal("/dev/pts/3", 19200, timeout=5)
+# Press Ctrl+C to stop; a summary is printed and the paper written to
+# the PNG file.  Or from Python:
+#   emu = ThermalEmulator()
+#   emu.start()
+#   printer = Adafruit_Thermal(emu.port, 19200, timeout=5)
+#   ...
+#   emu.stop()
+#   emu.image().save('out.png')
+#
+# Data can also be interpreted without a pty or any timing (e.g. the
+# contents of a PrintJob): ThermalEmulator.render(job.data) returns the
+# printed paper as an Image.
+#
+# MIT license, all text above must be included in any redistribution.
+#*************************************************************************
+
+from __future__ import print_function
+from Adafruit_Thermal import clock, invertTable, popTable
+import threading
+import time
+import os
+
+class ThermalEmulator(object):
+
+	# Physical characteristics default to those assumed by the driver's
+	# timing model.  'bufferSize' is the printer's input buffer (bytes),
+	# or None for unlimited.  By default every bitmap row takes the full
+	# dotPrintTime, however sparse -- independent of the driver's ink
+	# density model (Adafruit_Thermal.bitmapTime()), so runs against the
+	# emulator show whether that model's savings risk overruns.  To
+	# emulate a printer that is quicker on sparse rows, set 'inkBase'
+	# below 1: rows then take from inkBase times dotPrintTime (blank) up
+	# to the full time ('inkFull' or more black dots).
+	def __init__(self, baudrate=19200, firmware=268, bufferSize=4096,
+	  dotPrintTime=0.03, dotFeedTime=0.0021, width=384, inkBase=1.0,
+	  inkFull=96):
+		self.baudrate     = baudrate
+		self.firmware     = firmware
+		self.bufferSize   = bufferSize
+		self.dotPrintTime = dotPrintTime
+		self.dotFeedTime  = dotFeedTime
+		self.inkBase      = inkBase
+		self.inkFull      = inkFull
+		self.width        = width
+		self.rowBytes     = width // 8
+		self.buffer       = bytearray()
+		self.rows         = []    # Printed dot rows, 1 bits are black
+		self.replies      = bytearray()
+		self.received     = 0     # Bytes taken in
+		self.overruns     = 0     # Bytes lost to a full buffer
+		self.unknown      = 0     # Unrecognized commands
+		self.clock        = 0.0   # Simulated time of the printer
+		self.busyTime     = 0.0   # Time spent printing and feeding
+		self.font         = None
+		self.thread       = None
+		self.lock         = threading.Lock()
+		self.resetState()
+		self.program      = self.interpret()
+		self.request      = next(self.program)
+
+	def resetState(self):
+		self.printMode     = 0
+		self.charSize      = 0
+		self.inverse       = False
+		self.underline     = 0
+		self.bold          = False
+		self.upsideDown    = False
+		self.justification = 0
+		self.lineHeight    = 32
+		self.barcodeHeight = 50
+		self.barcodeWidth  = 3
+		self.hriPosition   = 0
+		self.line          = []
+
+	# Printed paper as a 1-bit Image.
+	def image(self):
+		from PIL import Image
+		return Image.frombytes('1', (self.width, len(self.rows)),
+		  b''.join(self.rows).translate(invertTable))
+
+	# Interprets 'data' start to finish, ignoring timing and buffer
+	# limits, and returns the resulting paper.
+	@classmethod
+	def render(cls, data, **kwargs):
+		emu = cls(bufferSize=None, **kwargs)
+		emu.receive(data)
+		emu.run(float('inf'))
+		emu.printLine(True) # Anything left unterminated
+		return emu.image()
+
+	# === Simulation ===
+
+	# Takes bytes into the input buffer, losing any that don't fit.
+	def receive(self, data):
+		self.received += len(data)
+		if self.bufferSize is not None:
+			room = self.bufferSize - len(self.buffer)
+			if len(data) > room:
+				self.overruns += len(data) - room
+				data = data[:room]
+		self.buffer += data
+
+	# Works through the buffer until simulated time 'until', or until
+	# it runs out of complete commands.  The interpreter (a generator)
+	# asks for either a number of bytes (int) or for time to pass while
+	# it prints or feeds (float).
+	def run(self, until):
+		while True:
+			r = self.request
+			if isinstance(r, float):
+				if self.clock > until: break
+				self.clock    += r
+				self.busyTime += r
+				self.request   = self.program.send(None)
+			elif len(self.buffer) >= r:
+				data = bytes(self.buffer[:r])
+				del self.buffer[:r]
+				self.request = self.program.send(data)
+			else:
+				# Idle, waiting for data
+				if self.clock < until: self.clock = until
+				break
+
+	# Opens the pty and starts taking in data in a background thread.
+	# The port name for the driver is then in 'port'.
+	def start(self):
+		import tty
+		self.master, self.slave = os.openpty()
+		tty.setraw(self.master)
+		tty.setraw(self.slave)
+		os.set_blocking(self.master, False)
+		self.port    = os.ttyname(self.slave)
+		self.running = True
+		self.started = clock()
+		self.thread  = threading.Thread(target=self.serve)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop(self):
+		if self.thread is None: return
+		self.running = False
+		self.thread.join()
+		self.thread = None
+		with self.lock:
+			self.printLine(True)
+		os.close(self.master)
+		os.close(self.slave)
+
+	# Reads from the pty at no more than the line rate (10 bits per
+	# byte), with the printer's clock following the wall clock.
+	def serve(self):
+		start  = last = self.started
+		credit = 0.0
+		while self.running:
+			time.sleep(0.001)
+			now     = clock()
+			credit  = min(credit + (now - last) * self.baudrate / 10.0,
+			  max(64.0, self.baudrate / 100.0))
+			last    = now
+			data    = b''
+			if credit >= 1:
+				try:
+					data = os.read(self.master, int(credit))
+				except (BlockingIOError, OSError):
+					pass
+			credit -= len(data)
+			with self.lock:
+				self.receive(data)
+				self.run(now - start)
+				if self.replies:
+					os.write(self.master, bytes(self.replies))
+					del self.replies[:]
+
+	# Waits until no data has arrived for 'quiet' seconds and the
+	# printer has finished printing (or is stuck waiting for the rest
+	# of a command, if some was lost).
+	def waitIdle(self, quiet=0.25):
+		received = -1
+		while True:
+			with self.lock:
+				done = (self.received == received and
+				  self.clock <= clock() - self.started)
+				received = self.received
+			if done: return
+			time.sleep(quiet)
+
+	def report(self):
+		return ('%d bytes received, %d overrun, %d unknown commands, '
+		  '%d dot rows, %.2f s printing/feeding' %
+		  (self.received, self.overruns, self.unknown,
+		   len(self.rows), self.busyTime))
+
+	# === Command interpreter ===
+
+	def interpret(self):
+		while True:
+			c = (yield 1)[0]
+			if c == 27:   # ESC
+				c = (yield 1)[0]
+				while c == 27: # Repeated ESC (old-firmware wake)
+					c = (yield 1)[0]
+				if c == 64:    # ESC @: initialize
+					yield self.printLine()
+					self.resetState()
+				elif c == 55:  # ESC 7: heat settings
+					yield 3
+				elif c == 33:  # ESC !: print mode
+					self.printMode = (yield 1)[0]
+				elif c == 100: # ESC d: print and feed lines
+					n = (yield 1)[0]
+					yield self.printLine()
+					yield self.feedDots(n * self.lineHeight)
+				elif c == 74:  # ESC J: print and feed dots
+					n = (yield 1)[0]
+					yield self.printLine()
+					yield self.feedDots(n)
+				elif c == 51:  # ESC 3: line height
+					self.lineHeight = max((yield 1)[0], 24)
+				elif c == 97:  # ESC a: justification
+					self.justification = (yield 1)[0] % 3
+				elif c == 45:  # ESC -: underline
+					self.underline = (yield 1)[0]
+				elif c == 69:  # ESC E: bold
+					self.bold = bool((yield 1)[0] & 1)
+				elif c == 123: # ESC {: upside-down
+					self.upsideDown = bool((yield 1)[0] & 1)
+				elif c == 118: # ESC v: status
+					yield 1
+					self.replies.append(0)
+				elif c == 68:  # ESC D: tab stops, to NUL
+					while (yield 1)[0]: pass
+				elif c == 56:  # ESC 8: sleep
+					yield 2 if self.firmware >= 264 else 1
+				elif c in (61, 82, 116, 32): # Online, charset,
+					yield 1                  # code page, spacing
+				else:
+					self.unknown += 1
+			elif c == 18: # DC2
+				c = (yield 1)[0]
+				if c == 35:    # DC2 #: density
+					yield 1
+				elif c == 42:  # DC2 *: bitmap
+					h, n = bytearray((yield 2))
+					yield self.printLine()
+					for y in range(h):
+						yield self.addRow((yield n))
+				elif c == 84:  # DC2 T: test page
+					yield self.printLine()
+					for text in ('TEST PAGE', ''):
+						self.line = list(text)
+						yield self.printLine(True)
+				else:
+					self.unknown += 1
+			elif c == 29: # GS
+				c = (yield 1)[0]
+				if c == 33:    # GS !: character size
+					self.charSize = (yield 1)[0]
+				elif c == 66:  # GS B: inverse
+					self.inverse = bool((yield 1)[0] & 1)
+				elif c == 72:  # GS H: barcode label position
+					self.hriPosition = (yield 1)[0]
+				elif c == 104: # GS h: barcode height
+					self.barcodeHeight = (yield 1)[0]
+				elif c == 119: # GS w: barcode width
+					self.barcodeWidth = (yield 1)[0]
+				elif c == 114: # GS r: status
+					yield 1
+					self.replies.append(0)
+				elif c == 97:  # GS a: status output
+					yield 1
+				elif c == 107: # GS k: barcode
+					m = (yield 1)[0]
+					if m >= 65: # Length-prefixed
+						data = (yield (yield 1)[0])
+					else:       # NUL-terminated
+						data = b''
+						while True:
+							b = (yield 1)
+							if b == b'\0': break
+							data += b
+					yield self.printLine()
+					yield self.printBarcode(data)
+				else:
+					self.unknown += 1
+			elif c == 10 or c == 12: # LF, FF: print line
+				yield self.printLine(True)
+			elif c == 9:             # Tab: stops every 4 columns
+				yield self.addChar(' ')
+				while len(self.line) % 4:
+					yield self.addChar(' ')
+			elif c >= 32 and c != 255:
+				yield self.addChar(chr(c))
+
+	# === Rendering ===
+
+	def widthScale(self):
+		if (self.printMode & (1 << 5)) or (self.charSize & 0xF0):
+			return 2
+		return 1
+
+	def heightScale(self):
+		if (self.printMode & (1 << 4)) or (self.charSize & 0x0F):
+			return 2
+		return 1
+
+	# Adds a bitmap row, returning the time taken to print it.
+	def addRow(self, row):
+		row = bytes(row[:self.rowBytes])
+		self.rows.append(row + bytes(self.rowBytes - len(row)))
+		ink = sum(bytearray(row.translate(popTable)))
+		return self.dotPrintTime * (self.inkBase + (1.0 -
+		  self.inkBase) * min(1.0, ink / float(self.inkFull)))
+
+	# Feeds blank paper, returning the time taken.
+	def feedDots(self, n):
+		self.rows.extend([bytes(self.rowBytes)] * n)
+		return n * self.dotFeedTime
+
+	# Adds a character to the line, printing the line first if full.
+	# Returns the time taken.
+	def addChar(self, c):
+		t = 0.0
+		if len(self.line) >= self.width // (12 * self.widthScale()):
+			t = self.printLine(True)
+		self.line.append(c)
+		return t
+
+	def getFont(self):
+		if self.font is None:
+			from PIL import ImageFont
+			try:
+				self.font = ImageFont.load_default(size=18)
+			except TypeError: # Older PIL: fixed bitmap font
+				self.font = ImageFont.load_default()
+		return self.font
+
+	# Prints the text line, if any (or with 'feed', a blank line if
+	# there's no text), returning the time taken.
+	def printLine(self, feed=False):
+		if not self.line:
+			if not feed: return 0.0
+			return self.feedDots(self.lineHeight)
+		from PIL import Image, ImageDraw
+		if self.inverse or self.printMode & 2:
+			paper, ink = 0, 1
+		else:
+			paper, ink = 1, 0
+		w, h = 12 * len(self.line), 24
+		line = Image.new('1', (w, h), paper)
+		draw = ImageDraw.Draw(line)
+		font = self.getFont()
+		bold = (0, 1) if self.bold or self.printMode & 8 else (0,)
+		for i, c in enumerate(self.line):
+			# Center each glyph in its 12x24 cell
+			x = i * 12 + (12 - int(draw.textlength(c, font))) // 2
+			for dx in bold:
+				draw.text((x + dx, 2), c, ink, font)
+		if self.underline:
+			draw.rectangle((0, h - 2, w - 1, h - 3 + self.underline),
+			  ink)
+		if self.printMode & (1 << 6): # Strike
+			draw.line((0, h // 2, w - 1, h // 2), ink, 2)
+		sw, sh = self.widthScale(), self.heightScale()
+		if sw > 1 or sh > 1:
+			line = line.resize((w * sw, h * sh), Image.NEAREST)
+		if self.upsideDown or self.printMode & 4:
+			line = line.rotate(180)
+		self.line = []
+		t = self.printImage(line)
+		return t + self.feedDots(max(self.lineHeight - 24, 0))
+
+	# Adds a 1-bit image (clipped to the paper and positioned per the
+	# justification) as printed rows, returning the time taken.
+	def printImage(self, image):
+		from PIL import Image
+		paper = Image.new('1', (self.width, image.size[1]), 1)
+		x = (self.width - image.size[0]) * self.justification // 2
+		paper.paste(image, (max(x, 0), 0))
+		data = paper.tobytes().translate(invertTable)
+		for y in range(image.size[1]):
+			self.rows.append(
+			  data[y * self.rowBytes:(y + 1) * self.rowBytes])
+		return image.size[1] * self.dotPrintTime
+
+	# Barcodes are drawn as a stand-in pattern (the bits of each data
+	# byte as bars, with label text below), not a scannable symbol.
+	def printBarcode(self, data):
+		from PIL import Image, ImageDraw
+		bw   = max(self.barcodeWidth, 1)
+		bits = [(b >> (7 - i)) & 1 for b in bytearray(data)
+		  for i in range(8)]
+		w    = min((len(bits) + 2) * bw, self.width)
+		bars = Image.new('1', (w, self.barcodeHeight), 1)
+		draw = ImageDraw.Draw(bars)
+		for i, bit in enumerate([1] + bits + [1]):
+			if bit:
+				draw.rectangle((i * bw, 0, i * bw + bw - 1,
+				  self.barcodeHeight), 0)
+		t = self.printImage(bars)
+		if self.hriPosition & 2:
+			self.line = list(data.decode('latin-1'))
+			t += self.printLine()
+		return t
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(
+	  description='Virtual thermal printer on a pseudo-terminal.')
+	parser.add_argument('-o', '--output', default='emulator.png',
+	  help='PNG file for the printed paper')
+	parser.add_argument('-b', '--baudrate', type=int, default=19200)
+	parser.add_argument('-f', '--firmware', type=int, default=268)
+	parser.add_argument('--buffer', type=int, default=4096,
+	  help='printer input buffer size (bytes)')
+	parser.add_argument('--print-time', type=float, default=0.03,
+	  help='seconds to print one dot row')
+	parser.add_argument('--feed-time', type=float, default=0.0021,
+	  help='seconds to feed one dot row')
+	parser.add_argument('--ink-base', type=float, default=1.0,
+	  help='time for a blank bitmap row, as a fraction of print time')
+	parser.add_argument('--ink-full', type=int, default=96,
+	  help='black dots from which a row takes the full print time')
+	args = parser.parse_args()
+
+	emu = ThermalEmulator(args.baudrate, args.firmware, args.buffer,
+	  args.print_time, args.feed_time, inkBase=args.ink_base,
+	  inkFull=args.ink_full)
+	emu.start()
+	print('Emulated printer on %s (Ctrl+C to stop)' % emu.port)
+	try:
+		while True:
+			time.sleep(1)
+	except KeyboardInterrupt:
+		pass
+	emu.stop()
+	print(emu.report())
+	if emu.rows:
+		emu.image().save(args.output)
+		print('Paper saved to %s' % args.output)
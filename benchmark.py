@@ -0,0 +1,917 @@
+#!/usr/bin/python
+
+# Micro-benchmarks for the Adafruit_Thermal library.  No printer is
+# required: output goes to an in-memory transport (MemoryTransport),
+# and the print/feed time estimates are zeroed so that only the host
+# CPU cost of the driver itself is measured.  Each benchmark also checks
+# that the optimized path emits exactly the same bytes (and the same
+# paper-time estimate) as the reference implementation it replaces.
+#
+# Also a workload suite (see suite()): text, bitmaps, images, barcodes
+# and a mixed receipt, each run against an in-memory transport and a
+# pty stand-in (ThermalEmulator), with results saved as JSON so that
+# versions can be compared.
+#
+# Usage: python benchmark.py
+#        python benchmark.py suite [results.json [baseline.json]]
+
+from __future__ import print_function
+from Adafruit_Thermal import *
+import json
+import time
+import sys
+
+# Printer writing to a MemoryTransport paced as for 19200 baud.  Also
+# totals every timeout set, i.e. the driver's estimate of paper time.
+class BenchPrinter(Adafruit_Thermal):
+
+	def __init__(self):
+		self.estimated = 0.0
+		Adafruit_Thermal.__init__(self,
+		  transport=MemoryTransport(19200))
+
+	def timeoutSet(self, x):
+		self.estimated += x
+		Adafruit_Thermal.timeoutSet(self, x)
+
+	# Forget anything sent (and estimated) so far.
+	def clear(self):
+		self.transport.clear()
+		self.estimated  = 0.0
+		self.resumeTime = 0.0
+
+	def output(self):
+		return bytes(self.transport.data)
+
+# Writes one character straight to the transport, as pySerial would
+# have sent a str.
+def sendChar(printer, c):
+	printer.transport.write(c.encode('latin-1'))
+
+# Reference implementation: the character-at-a-time write() loop this
+# library used before line coalescing, fed one character per call.
+def legacyWrite(printer, text):
+	for c in text:
+		printer.timeoutWait()
+		sendChar(printer, c)
+		d = printer.byteTime
+		if ((c == '\n') or
+		    (printer.column == printer.maxColumn)):
+			if printer.prevByte == '\n':
+				d += ((printer.charHeight +
+				       printer.lineSpacing) *
+				      printer.dotFeedTime)
+			else:
+				d += ((printer.charHeight *
+				       printer.dotPrintTime) +
+				      (printer.lineSpacing *
+				       printer.dotFeedTime))
+				printer.column = 0
+				c = '\n'
+		else:
+			printer.column += 1
+		printer.timeoutSet(d)
+		printer.prevByte = c
+
+# Reference implementation: printBitmap() as it was before bulk
+# transmission, issuing each raster byte with its own write.
+def legacyBitmap(printer, args):
+	w, h, bitmap = args
+	rowBytes = (w + 7) // 8
+	if rowBytes >= 48: rowBytesClipped = 48
+	else:              rowBytesClipped = rowBytes
+	i = 0
+	for rowStart in range(0, h, 255):
+		chunkHeight = min(h - rowStart, 255)
+		printer.writeBytes(18, 42, chunkHeight, rowBytesClipped)
+		for y in range(chunkHeight):
+			for x in range(rowBytesClipped):
+				sendChar(printer, chr(bitmap[i]))
+				i += 1
+			i += rowBytes - rowBytesClipped
+		printer.timeoutSet(chunkHeight * printer.dotPrintTime)
+	printer.prevByte = '\n'
+
+# Reference implementation: printImage()'s original per-pixel packing.
+def legacyPack(image):
+	if image.mode != '1':
+		image = image.convert('1')
+	width  = min(image.size[0], 384)
+	height = image.size[1]
+	rowBytes = (width + 7) // 8
+	bitmap   = bytearray(rowBytes * height)
+	pixels   = image.load()
+	for y in range(height):
+		n = y * rowBytes
+		x = 0
+		for b in range(rowBytes):
+			sum = 0
+			bit = 128
+			while bit > 0:
+				if x >= width: break
+				if pixels[x, y] == 0:
+					sum |= bit
+				x    += 1
+				bit >>= 1
+			bitmap[n + b] = sum
+	return width, height, bitmap
+
+def bulkBitmap(printer, args):
+	printer.printBitmap(*args, LaaT=False) # Fixed chunks, as legacy
+
+# Times fn(printer, arg) over several repetitions, returning the best
+# CPU time along with the printer's output and estimate from the run.
+def timeIt(printer, fn, arg, repeat=5):
+	best = None
+	for r in range(repeat):
+		printer.clear()
+		printer.column   = 0
+		printer.prevByte = '\n'
+		t = time.process_time()
+		fn(printer, arg)
+		t = time.process_time() - t
+		if best is None or t < best: best = t
+	return best, printer.output(), printer.estimated
+
+def benchWrite():
+	tweet = ('Adafruit Industries: Thermal printer + Raspberry Pi = '
+	  'the Internet of Things, one receipt at a time.\n\n')
+	text  = tweet * 200
+	p = BenchPrinter()
+	# Real timing constants (so the estimate comparison means
+	# something) but with pacing disabled for the measurement.
+	p.timeoutWait = lambda: None
+	tOld, outOld, estOld = timeIt(p, legacyWrite, text)
+	tNew, outNew, estNew = timeIt(p, Adafruit_Thermal.write, text)
+	assert outOld == outNew, 'write() output differs from reference'
+	assert abs(estOld - estNew) < 1e-6, 'write() timing differs'
+	print('write(), %d chars: per-char %.2f ms, coalesced %.2f ms '
+	  '(%.1fx), %d vs %d writes, est. paper time %.1f s' %
+	  (len(text), tOld * 1000, tNew * 1000, tOld / tNew,
+	   len(text), p.transport.writes, estNew))
+
+# Word wrapped text: the same tweets through printWrapped(), laid out
+# afresh (cache emptied each time) and from the layout cache.
+def benchWrap():
+	import Adafruit_Thermal as module
+	tweets = ['Tweet %d: Adafruit Industries: Thermal printer + '
+	  'Raspberry Pi = the Internet of Things, one receipt at a '
+	  'time.' % i for i in range(20)]
+	def wrap(p, tweets):
+		for t in tweets: p.printWrapped(t, 'J')
+	def fresh(p, tweets):
+		module.layoutCache.clear()
+		wrap(p, tweets)
+	p = BenchPrinter()
+	p.timeoutWait = lambda: None
+	tNew, out, est = timeIt(p, fresh, tweets * 10)
+	tHit, out, est = timeIt(p, wrap, tweets * 10)
+	print('printWrapped(), %d tweets: laid out %.2f ms, cached %.2f ms, '
+	  '%d writes, est. paper time %.1f s' % (len(tweets) * 10,
+	   tNew * 1000, tHit * 1000, p.transport.writes, est))
+
+# Code page transcoding: building a table, and write() with it on
+# plain ASCII and on accented/typographic text, vs. encoding with the
+# Python codec first (which can only replace what the page lacks).
+def benchCodepage():
+	import Adafruit_Thermal as module
+	t = time.process_time()
+	for page in module.codepageCodecs:
+		module.CodepageTable(module.codepageCodecs[page])
+	t = (time.process_time() - t) / len(module.codepageCodecs)
+	def codec(p, text):
+		p.write(text.encode('cp437', 'replace').decode('latin-1'))
+	plain = BenchPrinter()
+	plain.timeoutWait = lambda: None
+	p = BenchPrinter()
+	p.timeoutWait = lambda: None
+	p.setCodePage(Adafruit_Thermal.CODEPAGE_CP437)
+	for name, text in (('ASCII', u'Plain ASCII tweet text, as most '
+	  u'are.\n'), ('accented', u'Caf\u00e9 cr\u00e8me \u201cbr\u00fbl'
+	  u'\u00e9e\u201d \u2013 na\u00efve \u00bd \u20ac5 \u00c5ngstr\u00f6m.\n')):
+		text = text * 500
+		tOld, out, est = timeIt(plain, codec, text)
+		tNew, out, est = timeIt(p, Adafruit_Thermal.write, text)
+		print('write(), %d chars %s, CP437: codec %.2f ms, table %.2f ms '
+		  '(table built in %.2f ms)' % (len(text), name, tOld * 1000,
+		   tNew * 1000, t * 1000))
+
+def benchBitmap():
+	import gfx.adalogo as adalogo
+	import random
+	rnd   = random.Random(1)
+	full  = bytearray(rnd.getrandbits(8) for i in range(48 * 800))
+	wide  = bytearray(rnd.getrandbits(8) for i in range(64 * 800))
+	cases = [
+	  ('adalogo 75x75 (list)',
+	    (adalogo.width, adalogo.height, adalogo.data)),
+	  ('384x800 bytearray', (384, 800, full)),
+	  ('512x800 clipped',   (512, 800, wide)) ]
+	p = BenchPrinter()
+	p.timeoutWait = lambda: None
+	p.setInkModel(1.0) # Legacy timing: full time for every row
+	for name, args in cases:
+		tOld, outOld, estOld = timeIt(p, legacyBitmap, args, 3)
+		tNew, outNew, estNew = timeIt(p, bulkBitmap, args, 3)
+		assert outOld == outNew, 'printBitmap() output differs'
+		assert abs(estOld - estNew) < 1e-6, 'printBitmap() timing'
+		print('printBitmap(), %s: per-byte %.2f ms, bulk %.3f ms '
+		  '(%.0fx), %d writes' % (name, tOld * 1000, tNew * 1000,
+		   tOld / tNew, p.transport.writes))
+
+# Estimated paper time for the bundled bitmaps and artwork, with every
+# row charged the full print time vs. charged by its ink density.
+def benchInk():
+	from PIL import Image
+	import gfx.adalogo as adalogo
+	import gfx.adaqrcode as adaqrcode
+	import glob
+	cases = [('adalogo', (adalogo.width, adalogo.height, adalogo.data)),
+	  ('adaqrcode', (adaqrcode.width, adaqrcode.height, adaqrcode.data))]
+	for path in sorted(glob.glob('gfx/*.png')):
+		cases.append((path, packImage(Image.open(path))))
+	p = BenchPrinter()
+	p.timeoutWait = lambda: None
+	for name, args in cases:
+		est = []
+		for base in (1.0, 0.5):
+			p.setInkModel(base)
+			p.clear()
+			p.printBitmap(*args)
+			est.append(p.estimated)
+		print('print time, %s: flat %.2f s, by ink %.2f s (-%.0f%%)' %
+		  (name, est[0], est[1], (1 - est[1] / est[0]) * 100))
+
+# The ink density model against the pty stand-in, on a long, sparse
+# bitmap over a link fast enough that only the print time estimates
+# hold the driver back: bytes overrun with the model off, with it on
+# for a printer that prints every row in the full time, and with it on
+# for a printer that's quicker on sparse rows as the model assumes.
+def benchInkPty(baudrate=1000000):
+	from ThermalEmulator import ThermalEmulator
+	row = bytes(bytearray([0x81] + [0] * 46 + [0x81])) # 4 dots
+	for driver, printer in ((1.0, 1.0), (0.5, 1.0), (0.5, 0.5)):
+		emu = ThermalEmulator(baudrate, dotPrintTime=0.003,
+		  dotFeedTime=0.00021, inkBase=printer)
+		emu.start()
+		p = Adafruit_Thermal(emu.port, baudrate)
+		p.setTimes(3000, 210)
+		p.setInkModel(driver)
+		p.timeoutWait()
+		t = clock()
+		p.printBitmap(384, 1000, row * 1000)
+		p.timeoutWait()
+		t = clock() - t
+		emu.waitIdle(0.05)
+		p.close()
+		emu.stop()
+		print('ink model %.1f, printer %.1f: 384x1000 sparse bitmap sent '
+		  'in %.2f s, %d bytes overrun' % (driver, printer, t,
+		   emu.overruns))
+		if driver == printer:
+			assert emu.overruns == 0, 'ink model overruns'
+
+# Image packing on the bundled artwork (dithering excluded; images are
+# converted to 1-bit up front so only the packing itself is timed).
+def benchPack():
+	from PIL import Image
+	import glob
+	methods = ['pil']
+	if numpy is not None: methods.append('numpy')
+	for path in sorted(glob.glob('gfx/*.png')):
+		image = Image.open(path).convert('1')
+		t = time.process_time()
+		ref = legacyPack(image)
+		tOld = time.process_time() - t
+		results = []
+		for method in methods:
+			t = time.process_time()
+			for r in range(10):
+				w, h, bitmap = packImage(image, method)
+			t = (time.process_time() - t) / 10
+			assert (w, h) == ref[:2], 'packImage() size differs'
+			assert bytes(bytearray(bitmap)) == bytes(ref[2]), (
+			  'packImage(%s) output differs' % method)
+			results.append('%s %.2f ms (%.0fx)' %
+			  (method, t * 1000, tOld / t))
+		print('packImage(), %s %dx%d: per-pixel %.1f ms, %s' %
+		  (path, image.size[0], image.size[1], tOld * 1000,
+		   ', '.join(results)))
+
+# Dither modes on the bundled artwork and on a synthetic camera-sized
+# photo (4000x3000 RGB, as from the photo booth), through packImage().
+def benchDither():
+	from PIL import Image
+	import glob
+	if numpy is None:
+		print('dithering: NumPy not installed, skipped')
+		return
+	rnd   = numpy.random.RandomState(1)
+	ramp  = numpy.add.outer(numpy.linspace(0, 200, 3000),
+	  numpy.linspace(0, 55, 4000))
+	photo = Image.fromarray((ramp + rnd.randint(0, 20, ramp.shape)
+	  ).astype(numpy.uint8), 'L').convert('RGB')
+	cases = [(path, Image.open(path).convert('RGB'))
+	  for path in sorted(glob.glob('gfx/*.png'))]
+	cases.append(('photo 4000x3000', photo))
+	for name, image in cases:
+		times = []
+		for mode in ditherModes:
+			t = time.process_time()
+			packImage(image, dither=mode)
+			times.append(time.process_time() - t)
+		print('dither, %s: %s' % (name, ', '.join(
+		  '%s %.1f ms' % (mode, t * 1000)
+		  for mode, t in zip(ditherModes, times))))
+
+# Peak memory (Python allocations) converting a 384x20000 log strip,
+# tiled vs. all at once, and time scaling a camera-sized photo to fit.
+def benchTiles():
+	from PIL import Image
+	import tracemalloc
+	if numpy is None:
+		print('tiling: NumPy not installed, skipped')
+		return
+	rnd   = numpy.random.RandomState(1)
+	strip = Image.fromarray(rnd.randint(0, 256, (20000, 384)
+	  ).astype(numpy.uint8), 'L')
+	for name, tileHeight in (('tiled', 1024), ('whole', 20000)):
+		job = PrintJob()
+		job.tileHeight = tileHeight
+		tracemalloc.start()
+		t = time.process_time()
+		job.printImage(strip, dither='bayer')
+		t = time.process_time() - t
+		peak = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+		print('printImage(), 384x20000 strip, %s: %.0f ms, peak %.1f MB '
+		  '(%.1f MB output)' % (name, t * 1000, peak / 1e6,
+		   len(job.data) / 1e6))
+	photo = Image.new('RGB', (4000, 3000), (128, 128, 128))
+	job = PrintJob()
+	t = time.process_time()
+	job.printImage(photo, dither='bayer', fit=True)
+	t = time.process_time() - t
+	print('printImage(), 4000x3000 photo scaled to fit: %.0f ms' %
+	  (t * 1000))
+
+# TrueType text: lines rendered with glyphs rasterized afresh vs. from
+# the glyph cache, using the first TrueType font found on the system.
+def benchRasterText():
+	from RasterText import RasterFont, GlyphCache
+	import glob
+	# Numbers in right-to-left text keep their digits in order
+	for line, visual in ((u'\u05e9\u05dc\u05d5\u05dd 123 \u05e2\u05d5'
+	  u'\u05dc\u05dd', u'\u05dd\u05dc\u05d5\u05e2 123 \u05dd\u05d5'
+	  u'\u05dc\u05e9'), (u'\u0627\u0644\u0633\u0639\u0631 \u0661'
+	  u'\u0662\u0663 / 1,000.50', u'1,000.50 / \u0661\u0662\u0663 '
+	  u'\u0631\u0639\u0633\u0644\u0627')):
+		assert RasterFont.visualOrder(line) == visual, (
+		  RasterFont.visualOrder(line))
+	fonts = sorted(glob.glob('/usr/share/fonts/**/*.ttf', recursive=True))
+	if not fonts:
+		print('raster text: no TrueType fonts found, skipped')
+		return
+	text = (u'Receipt #%d: 2 x Caf\u00e9 cr\u00e8me, 1 x Cr\u00eape '
+	  u'\u00e0 la fran\u00e7aise.  Thank you for your visit!\n')
+	for name, cache in (('fresh', None), ('cached', GlyphCache())):
+		t = time.process_time()
+		for i in range(20):
+			font = RasterFont(fonts[0], 24,
+			  cache=GlyphCache() if cache is None else cache)
+			job  = PrintJob()
+			job.printRasterText(text % i, font)
+		t = time.process_time() - t
+		print('printRasterText(), 20 receipts in %s, glyphs %s: %.1f ms' %
+		  (fonts[0].split('/')[-1], name, t * 1000))
+
+# Reference implementation: printBitmap()'s original stdout output,
+# a character per byte through the text-mode sys.stdout.
+def legacyStdoutBitmap(out, w, h, bitmap):
+	rowBytes = (w + 7) // 8
+	i = 0
+	for rowStart in range(0, h, 255):
+		chunkHeight = min(h - rowStart, 255)
+		for b in (18, 42, chunkHeight, rowBytes):
+			out.write(chr(b))
+		for j in range(chunkHeight * rowBytes):
+			out.write(chr(bitmap[i]))
+			i += 1
+
+# Piping a tall image through stdout (as for 'lp -o raw'), to a file.
+def benchStdout():
+	import io, os, tempfile, random
+	rnd    = random.Random(1)
+	h      = 2000
+	bitmap = bytearray(rnd.getrandbits(8) for i in range(48 * h))
+	with tempfile.TemporaryFile() as f:
+		text = io.TextIOWrapper(f, encoding='latin-1',
+		  write_through=True)
+		t = time.process_time()
+		legacyStdoutBitmap(text, 384, h, bitmap)
+		text.flush()
+		tOld = time.process_time() - t
+		f.seek(0)
+		ref = f.read()
+		text.detach()
+	with tempfile.TemporaryFile() as f:
+		p = Adafruit_Thermal(output=f)
+		p.flushOutput()
+		f.seek(0)
+		f.truncate()
+		t = time.process_time()
+		p.printBitmap(384, h, bitmap, False) # 255-row chunks
+		p.flushOutput()
+		tNew = time.process_time() - t
+		f.seek(0)
+		assert f.read() == ref, 'stdout output differs'
+	print('stdout, 384x%d bitmap: per-byte %.1f ms, batched %.2f ms '
+	  '(%.0fx)' % (h, tOld * 1000, tNew * 1000, tOld / tNew))
+
+# Stand-in for a printer with its DTR busy output connected: reads from
+# a pty, 'prints' what it receives at 'rate' bytes/sec from a buffer of
+# 'capacity' bytes, and asserts busy whenever the buffer holds more than
+# 'threshold' bytes -- i.e. for as long as printing that backlog takes.
+# Anything arriving with the buffer full is counted as an overrun.
+class BusyStandIn(object):
+
+	def __init__(self, rate=4800, capacity=4096, threshold=2048):
+		import os, tty, threading
+		self.rate      = float(rate)
+		self.capacity  = capacity
+		self.threshold = threshold
+		self.fill      = 0.0
+		self.stamp     = clock()
+		self.received  = 0
+		self.overruns  = 0
+		self.running   = True
+		self.lock      = threading.Lock()
+		self.master, slave = os.openpty()
+		tty.setraw(self.master)
+		tty.setraw(slave)
+		os.set_blocking(self.master, False)
+		self.port  = os.ttyname(slave)
+		self.slave = slave
+		self.thread = threading.Thread(target=self.run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	# Takes in whatever has arrived and updates the buffer level.
+	def poll(self):
+		import os
+		with self.lock:
+			now = clock()
+			self.fill  = max(0.0,
+			  self.fill - (now - self.stamp) * self.rate)
+			self.stamp = now
+			try:
+				n = len(os.read(self.master, 65536))
+			except BlockingIOError:
+				n = 0
+			self.received += n
+			self.fill     += n
+			if self.fill > self.capacity:
+				self.overruns += int(self.fill - self.capacity)
+				self.fill      = self.capacity
+
+	# Reading here, not just in the background thread, means the
+	# busy line reflects everything sent so far (a pty only hands
+	# data over once its reader gets around to asking).
+	def busy(self):
+		self.poll()
+		return self.fill > self.threshold
+
+	def run(self):
+		while self.running:
+			self.poll()
+			time.sleep(0.001)
+
+	def close(self):
+		self.running = False
+		self.thread.join()
+
+# Flow-controlled vs. open-loop pacing, sending a bitmap to a pty
+# stand-in whose real speed is well above the conservative estimates.
+def benchFlow():
+	standIn = BusyStandIn()
+	bitmap  = bytes(bytearray(range(256)) * 75) # 384x50
+	for name, pacing in (('open-loop', 'sleep'),
+	  ('flow control', FlowPacer(standIn.busy))):
+		p = Adafruit_Thermal(standIn.port, 19200, pacing=pacing)
+		p.timeoutWait()
+		while standIn.busy(): time.sleep(0.01)
+		start = standIn.received
+		overruns = standIn.overruns
+		t = clock()
+		for i in range(4):
+			p.printBitmap(384, 50, bitmap)
+		p.timeoutWait()
+		t = clock() - t
+		time.sleep(0.05)
+		print('%-12s: %d bytes in %.2f s, %d bytes overrun' %
+		  (name, standIn.received - start, t,
+		   standIn.overruns - overruns))
+		assert standIn.overruns == overruns, '%s overran' % name
+		p.close()
+	standIn.close()
+
+# Printer farm scaling: a fixed batch of jobs of assorted lengths sent
+# to farms of 1, 2 and 4 in-memory printers, paced as for real but with
+# print/feed times scaled down so the whole run takes a few seconds.
+def benchFarm():
+	from PrinterFarm import PrinterFarm
+	import random
+	rnd = random.Random(1)
+	rows = [rnd.choice((10, 20, 40, 80)) for i in range(24)]
+	base = None
+	for n in (1, 2, 4):
+		printers = [Adafruit_Thermal(
+		  transport=MemoryTransport(1000000)) for i in range(n)]
+		for p in printers: p.setTimes(3000, 210) # 1/10 real
+		farm = PrinterFarm(printers)
+		jobs = []
+		for h in rows:
+			job = farm.newJob()
+			job.printBitmap(384, h, bytes(48 * h))
+			job.println('%d rows' % h)
+			jobs.append(job)
+		t = clock()
+		for job in jobs: farm.submit(job)
+		farm.flush()
+		t = clock() - t
+		if base is None: base = t
+		util = farm.utilization()
+		print('farm of %d: %d jobs in %.2f s (%.1fx), utilization '
+		  '%s' % (n, len(jobs), t, base / t,
+		   ' '.join('%.0f%%' % (u * 100) for u in util)))
+		farm.close()
+
+	# Unpaced printers (as for TCP or an lp device) still share the
+	# work, whether jobs are estimated by the usual times or, with
+	# those zeroed, all estimated to take no time.
+	for times in ((30000, 2100), (0, 0)):
+		printers = [Adafruit_Thermal(transport=MemoryTransport())
+		  for i in range(3)]
+		for p in printers: p.setTimes(*times)
+		farm = PrinterFarm(printers)
+		used = set()
+		for h in rows[:9]:
+			job = farm.newJob()
+			job.printBitmap(384, h, bytes(48 * h))
+			used.add(farm.submit(job))
+		farm.close()
+		assert len(used) > 1, 'unpaced farm used one printer only'
+		print('farm of 3 unpaced, times %d/%d us: 9 jobs sent to %d '
+		  'printers' % (times + (len(used),)))
+
+# Streaming a tall photo, scaled to fit, to an in-memory printer paced
+# as for real, but with print/feed times scaled down to 1/100 -- as if
+# on a host far slower than this one, where converting a band takes
+# longer than the printer needs to finish the previous one.  Total
+# time and time to first byte, with each band converted only once the
+# previous one is sent, vs. converted while the previous one prints.
+def benchStream():
+	from PIL import Image
+	if numpy is None:
+		print('streaming: NumPy not installed, skipped')
+		return
+	rnd   = numpy.random.RandomState(1)
+	photo = Image.fromarray(rnd.randint(0, 256, (12000, 2000)
+	  ).astype(numpy.uint8), 'L')
+	for name, depth in (('serial', 0), ('prefetch', 1)):
+		p = Adafruit_Thermal(transport=TimedTransport(
+		  MemoryTransport(1000000)))
+		p.setTimes(300, 21)
+		p.tileHeight    = 256
+		p.prefetchBands = depth
+		p.timeoutWait()
+		p.transport.mark()
+		t = clock()
+		p.printImage(photo, dither='atkinson', fit=True)
+		p.timeoutWait()
+		end = clock()
+		print('printImage(), 2000x12000 photo fit in 256-row bands, '
+		  '%-8s: %.2f s, first byte %.0f ms' % (name, end - t,
+		   (p.transport.first - t) * 1000))
+
+# Pacing engines: CPU time consumed while waiting out a series of
+# printer timeouts, and how precisely each wait hit its target.
+def benchPacing():
+	durations = [0.0002, 0.001, 0.005, 0.02] * 25
+	for name, pacer in (('spin', SpinPacer()), ('sleep', SleepPacer())):
+		late = []
+		cpu  = time.process_time()
+		wall = time.time()
+		for d in durations:
+			pacer.wait(clock() + d)
+			late.append(pacer.lastLate)
+		cpu  = time.process_time() - cpu
+		wall = time.time() - wall
+		late.sort()
+		print('%-5s pacer: %.2f s waited, CPU %.3f s (%3.0f%%), late by '
+		  'median %.1f us, max %.1f us' %
+		  (name, pacer.totalWait, cpu, cpu * 100 / wall,
+		   late[len(late) // 2] * 1e6, late[-1] * 1e6))
+
+# === Workload suite ===
+
+# Transport wrapper noting the time of the first write and the total
+# bytes written, for time-to-first-byte and byte counts.
+class TimedTransport(Transport):
+
+	def __init__(self, transport):
+		self.transport = transport
+		self.paced     = transport.paced
+		self.byteTime  = transport.byteTime
+		self.mark()
+
+	# Starts a new measurement.
+	def mark(self):
+		self.first = None
+		self.bytes = 0
+
+	def write(self, data):
+		if self.first is None: self.first = clock()
+		self.bytes += len(data)
+		self.transport.write(data)
+
+	def read(self, n=1):        return self.transport.read(n)
+	def flush(self):            self.transport.flush()
+	def drain(self):            self.transport.drain()
+	def resetInput(self):       self.transport.resetInput()
+	def close(self):            self.transport.close()
+
+class SuitePrinter(BenchPrinter):
+
+	def __init__(self, transport):
+		self.estimated = 0.0
+		Adafruit_Thermal.__init__(self,
+		  transport=TimedTransport(transport))
+
+def workText(p):
+	para = ('The quick brown fox jumps over the lazy dog; pack my box '
+	  'with five dozen liquor jugs.  ') * 4
+	for size in 'SML':
+		p.setSize(size)
+		p.println(para)
+	p.setSize('S')
+	for i in range(20):
+		p.print('Line %d: ' % i)
+		p.println(para[:20 + i * 3])
+
+def workWrapped(p):
+	para = ('The quick brown fox jumps over the lazy dog; pack my box '
+	  'with five dozen liquor jugs.  ') * 4
+	for size in 'SML':
+		p.setSize(size)
+		p.printWrapped(para, 'J')
+	p.setSize('S')
+	for i in range(20):
+		p.print('Line %d: ' % i)
+		p.printWrapped(para[:20 + i * 3])
+
+def workBitmap(module):
+	def work(p):
+		m = __import__('gfx.' + module, fromlist=[module])
+		p.printBitmap(m.width, m.height, m.data)
+	return work
+
+def workImage(path, LaaT):
+	def work(p):
+		from PIL import Image
+		p.printImage(Image.open(path), LaaT)
+	return work
+
+def workBarcode(p):
+	p.printBarcode('ADAFRUT', p.CODE39)
+	p.setBarcodeHeight(100)
+	p.printBarcode('123456789123', p.UPC_A)
+	p.setBarcodeHeight(50)
+
+# Same sequence as printertest.py
+def workReceipt(p):
+	import gfx.adalogo as adalogo
+	import gfx.adaqrcode as adaqrcode
+	p.inverseOn()
+	p.println('Inverse ON')
+	p.inverseOff()
+	p.doubleHeightOn()
+	p.println('Double Height ON')
+	p.doubleHeightOff()
+	for j in 'RCL':
+		p.justify(j)
+		p.println({'R': 'Right', 'C': 'Center', 'L': 'Left'}[j] +
+		  ' justified')
+	p.boldOn()
+	p.println('Bold text')
+	p.boldOff()
+	p.underlineOn()
+	p.println('Underlined text')
+	p.underlineOff()
+	for size, text in (('L', 'Large'), ('M', 'Medium'), ('S', 'Small')):
+		p.setSize(size)
+		p.println(text)
+	p.justify('C')
+	p.println('normal\nline\nspacing')
+	p.setLineHeight(50)
+	p.println('Taller\nline\nspacing')
+	p.setLineHeight()
+	p.justify('L')
+	p.feed(1)
+	workBarcode(p)
+	p.printBitmap(adalogo.width, adalogo.height, adalogo.data)
+	p.printBitmap(adaqrcode.width, adaqrcode.height, adaqrcode.data)
+	p.println('Adafruit!')
+	p.feed(2)
+
+def workloads():
+	import glob
+	work = [('text', workText), ('text wrapped', workWrapped),
+	  ('bitmap adalogo', workBitmap('adalogo')),
+	  ('bitmap adaqrcode', workBitmap('adaqrcode'))]
+	for path in sorted(glob.glob('gfx/*.png')):
+		for LaaT, mode in ((False, ''), (True, ' LaaT'),
+		  (None, ' adaptive')):
+			work.append(('image %s%s' % (path, mode),
+			  workImage(path, LaaT)))
+	work += [('barcode', workBarcode), ('receipt', workReceipt)]
+	return work
+
+# Runs one workload, returning its measurements.  'wall' runs to the
+# end of the driver's last wait, so includes pacing where enabled.
+def measure(p, work):
+	p.reset()
+	p.timeoutWait()
+	p.flushOutput()
+	p.estimated = 0.0
+	p.transport.mark()
+	wall = clock()
+	cpu  = time.process_time()
+	work(p)
+	p.timeoutWait()
+	p.flushOutput()
+	cpu  = time.process_time() - cpu
+	done = clock()
+	first = p.transport.first
+	return { 'cpu': cpu, 'wall': done - wall, 'bytes': p.transport.bytes,
+	  'estimated': p.estimated,
+	  'ttfb': None if first is None else first - wall }
+
+# Every workload against an in-memory transport: no pacing, so 'cpu'
+# is the driver's own cost; best of 'repeat' runs.
+def suiteMemory(repeat=3):
+	p = SuitePrinter(MemoryTransport(19200))
+	p.timeoutWait = lambda: None
+	results = {}
+	for name, work in workloads():
+		best = None
+		for r in range(repeat):
+			m = measure(p, work)
+			p.transport.transport.clear()
+			if best is None or m['cpu'] < best['cpu']: best = m
+		results[name] = best
+	return results
+
+# Every workload sent to a ThermalEmulator over a pty, fully paced,
+# with print/feed times (of both driver and emulator) at 1/10 real so
+# the run takes seconds rather than minutes.  Also notes any overruns.
+def suitePty(baudrate=115200):
+	from ThermalEmulator import ThermalEmulator
+	emu = ThermalEmulator(baudrate, dotPrintTime=0.003,
+	  dotFeedTime=0.00021)
+	emu.start()
+	p = SuitePrinter(SerialTransport(emu.port, baudrate))
+	p.setTimes(3000, 210)
+	results = {}
+	for name, work in workloads():
+		overruns = emu.overruns
+		m = measure(p, work)
+		emu.waitIdle(0.05)
+		m['overruns'] = emu.overruns - overruns
+		results[name] = m
+	p.close()
+	emu.stop()
+	return results
+
+# Closed-loop timing (adaptive=True) against the pty stand-in, whose
+# print and feed times are a third of the driver's nominal ones: the
+# tuner should bring its scale down to about 1/3 plus its margin.  A
+# fast link keeps transmission time out of the measurements.
+def benchTuner(baudrate=1000000):
+	from ThermalEmulator import ThermalEmulator
+	import random
+	rnd    = random.Random(1)
+	bitmap = bytes(bytearray(rnd.getrandbits(8) for i in range(48 * 20)))
+	emu = ThermalEmulator(baudrate, dotPrintTime=0.01,
+	  dotFeedTime=0.0007)
+	emu.start()
+	p = Adafruit_Thermal(emu.port, baudrate, timeout=1, adaptive=True)
+	p.setInkModel(1.0)
+	p.setTimes(30000, 2100) # Also restarts the tuner from this baseline
+	p.tuner.interval  = 0.2
+	p.tuner.nextCheck = clock()
+	t = clock()
+	while clock() - t < 5:
+		p.printBitmap(384, 20, bitmap)
+		p.println('Tuning...')
+	p.timeoutWait()
+	emu.waitIdle(0.05)
+	p.close()
+	emu.stop()
+	scale = p.tuner.scale
+	assert p.tuner.enabled, 'TimingTuner: status query unanswered'
+	assert 0.3 < scale < 0.5, 'TimingTuner: scale %.2f' % scale
+	print('TimingTuner, pty printer 3x faster: scale %.2f after %d '
+	  'queries, %d bytes overrun' % (scale, len(p.tuner.history),
+	   emu.overruns))
+
+# Smoke check of the asyncio front end: a little text, an image and a
+# status query through AsyncThermal to the pty stand-in, checking that
+# it all arrives without overruns and the query is answered.
+def benchAsync(baudrate=115200):
+	from ThermalEmulator import ThermalEmulator
+	from AsyncThermal import AsyncThermal
+	import asyncio
+	emu = ThermalEmulator(baudrate, dotPrintTime=0.003,
+	  dotFeedTime=0.00021)
+	emu.start()
+	lag = [0.0]
+	async def tick():
+		# Longest the event loop went without getting back to us
+		while True:
+			t = clock()
+			await asyncio.sleep(0.001)
+			lag[0] = max(lag[0], clock() - t - 0.001)
+	async def run():
+		ticker = asyncio.ensure_future(tick())
+		p = AsyncThermal(emu.port, baudrate)
+		p.job.setTimes(3000, 210)
+		await p.println('Hello from asyncio!')
+		await p.printImage('gfx/hello.png')
+		await p.printImage('gfx/sudoku.png', LaaT=True)
+		paper = await p.hasPaper()
+		await p.feed(2)
+		await p.finish()
+		p.close()
+		ticker.cancel()
+		return paper
+	t = clock()
+	paper = asyncio.run(run())
+	t = clock() - t
+	emu.waitIdle(0.05)
+	emu.stop()
+	assert paper, 'AsyncThermal: no paper status reply'
+	assert emu.overruns == 0, 'AsyncThermal: %d bytes overrun' % (
+	  emu.overruns)
+	assert len(emu.rows) > 200, 'AsyncThermal: nothing printed'
+	print('AsyncThermal, pty: text + images + status in %.2f s, loop '
+	  'lag max %.1f ms, %s' % (t, lag[0] * 1000, emu.report()))
+
+def suite(output='benchmark.json', baseline=None):
+	import platform
+	results = { 'python': platform.python_version(),
+	  'numpy': numpy is not None, 'time': time.time(),
+	  'memory': suiteMemory(), 'pty': suitePty() }
+	old = None
+	if baseline is not None:
+		with open(baseline) as f:
+			old = json.load(f)
+	for sink in ('memory', 'pty'):
+		print('%s:' % sink)
+		for name, m in sorted(results[sink].items()):
+			line = ('  %-28s CPU %7.2f ms, %6d bytes, est. %6.2f s, '
+			  'first byte %6.2f ms' % (name, m['cpu'] * 1000,
+			   m['bytes'], m['estimated'], (m['ttfb'] or 0) * 1000))
+			if sink == 'pty':
+				line += ', wall %.2f s, %d overrun' % (
+				  m['wall'], m['overruns'])
+			ref = old and old.get(sink, {}).get(name)
+			if ref and ref['cpu'] > 0:
+				line += ' (CPU %+.0f%%)' % (
+				  (m['cpu'] / ref['cpu'] - 1) * 100)
+			print(line)
+	with open(output, 'w') as f:
+		json.dump(results, f, indent=1, sort_keys=True)
+	print('Results saved to %s' % output)
+
+if __name__ == '__main__':
+	if len(sys.argv) > 1 and sys.argv[1] == 'suite':
+		suite(*sys.argv[2:4])
+		sys.exit(0)
+	benchWrite()
+	benchWrap()
+	benchCodepage()
+	benchBitmap()
+	benchInk()
+	benchInkPty()
+	benchPack()
+	benchDither()
+	benchTiles()
+	benchRasterText()
+	benchStdout()
+	benchPacing()
+	benchFlow()
+	benchFarm()
+	benchAsync()
+	benchTuner()
+	benchStream()
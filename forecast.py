@@ -34,14 +34,12 @@ def forecast(idx):
     lo      = data['daily']['data'][idx]['temperatureMin']
     hi      = data['daily']['data'][idx]['temperatureMax']
     cond    = data['daily']['data'][idx]['summary']
-    printer.print(day + ': low ' + str(lo) )
-    printer.print(deg)
-    printer.print(' high ' + str(hi))
-    printer.print(deg)
-    printer.println(' ' + cond.replace(u'\u2013', '-').encode('utf-8')) # take care of pesky unicode dash
+    printer.printWrapped(day + ': low ' + str(lo) + deg + ' high ' +
+      str(hi) + deg + ' ' + cond)
 
 printer = Adafruit_Thermal("/dev/serial0", 19200, timeout=5)
-deg     = chr(0xf8) # Degree symbol on thermal printer
+deg     = u'\u00b0' # Degree symbol, code page 437 has it
+printer.setCodePage(Adafruit_Thermal.CODEPAGE_CP437)
 
 url = "https://api.darksky.net/forecast/"+API_KEY+"/"+LAT+","+LONG+"?exclude=[alerts,minutely,hourly,flags]&units=us"
 response = urllib.urlopen(url)
@@ -49,24 +47,22 @@ data = json.loads(response.read())
 
 # Print heading
 printer.inverseOn()
-printer.print('{:^32}'.format("DarkSky.Net Forecast"))
+printer.printWrapped("DarkSky.Net Forecast", 'C', pad=True)
 printer.inverseOff()
 
 # Print current conditions
 printer.boldOn()
-printer.print('{:^32}'.format('Current conditions:'))
+printer.printWrapped('Current conditions:', 'C')
 printer.boldOff()
 
 
 temp = data['currently']['temperature']
 cond = data['currently']['summary']
-printer.print(temp)
-printer.print(deg)
-printer.println(' ' + cond)
+printer.printWrapped(str(temp) + deg + ' ' + cond)
 printer.boldOn()
 
 # Print forecast
-printer.print('{:^32}'.format('Forecast:'))
+printer.printWrapped('Forecast:', 'C')
 printer.boldOff()
 forecast(0)
 forecast(1)
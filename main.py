@@ -16,9 +16,11 @@
 
 from __future__ import print_function
 import RPi.GPIO as GPIO
-import subprocess, time, socket
+import subprocess, time, socket, os
 from PIL import Image
 from Adafruit_Thermal import *
+from RasterCache import RasterCache
+from Metrics import Metrics
 
 ledPin       = 18
 buttonPin    = 23
@@ -27,12 +29,22 @@ tapTime      = 0.01  # Debounce time for button taps
 nextInterval = 0.0   # Time of next recurring operation
 dailyFlag    = False # Set after daily trigger occurs
 lastId       = '1'   # State information passed to/from interval script
-printer      = Adafruit_Thermal("/dev/serial0", 19200, timeout=5)
+metrics      = Metrics()
+printer      = Adafruit_Thermal("/dev/serial0", 19200, timeout=5,
+                 rasterCache=RasterCache(), # Greeting/goodbye art
+                 threaded=True,             # Print in background
+                 metrics=metrics)
+# Printer metrics for the Prometheus node exporter's textfile collector,
+# written every minute if its directory exists.
+metricsFile  = '/var/lib/node_exporter/textfile_collector/thermal.prom'
+if os.path.isdir(os.path.dirname(metricsFile)):
+  metrics.startDump(metricsFile, 60)
 
 
 # Called when button is briefly tapped.  Invokes time/temperature script.
 def tap():
   GPIO.output(ledPin, GPIO.HIGH)  # LED on while working
+  printer.flushQueue()            # Scripts share the port; finish ours
   subprocess.call(["python", "timetemp.py"])
   GPIO.output(ledPin, GPIO.LOW)
 
@@ -40,8 +52,9 @@ def tap():
 # Called when button is held down.  Prints image, invokes shutdown process.
 def hold():
   GPIO.output(ledPin, GPIO.HIGH)
-  printer.printImage(Image.open('gfx/goodbye.png'), True)
+  printer.printImage(Image.open('gfx/goodbye.png'))
   printer.feed(3)
+  printer.flushQueue() # Finish printing before shutting down
   subprocess.call("sync")
   subprocess.call(["shutdown", "-h", "now"])
   GPIO.output(ledPin, GPIO.LOW)
@@ -51,6 +64,7 @@ def hold():
 # Invokes twitter script.
 def interval():
   GPIO.output(ledPin, GPIO.HIGH)
+  printer.flushQueue()
   p = subprocess.Popen(["python", "twitter.py", str(lastId)],
     stdout=subprocess.PIPE)
   GPIO.output(ledPin, GPIO.LOW)
@@ -61,6 +75,7 @@ def interval():
 # Invokes weather forecast and sudoku-gfx scripts.
 def daily():
   GPIO.output(ledPin, GPIO.HIGH)
+  printer.flushQueue()
   subprocess.call(["python", "forecast.py"])
   subprocess.call(["python", "sudoku-gfx.py"])
   GPIO.output(ledPin, GPIO.LOW)
@@ -95,10 +110,11 @@ except:
 	printer.print('Connect display and keyboard\n'
 	  'for network troubleshooting.')
 	printer.feed(3)
+	printer.flushQueue()
 	exit(0)
 
 # Print greeting image
-printer.printImage(Image.open('gfx/hello.png'), True)
+printer.printImage(Image.open('gfx/hello.png'))
 printer.feed(3)
 GPIO.output(ledPin, GPIO.LOW)
 
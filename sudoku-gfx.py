@@ -43,7 +43,7 @@ def main():
     puzzles = [makepuzzle(solution([None] * 81))]
   for puzzle in puzzles:
     printboard(puzzle)           # Doesn't print, just modifies 'bg' image
-    printer.printImage(bg, True) # This does the printing
+    printer.printImage(bg) # This does the printing
     printer.println("RATING:", ratepuzzle(puzzle, 4))
     if len(args) > 0:
       printer.println()
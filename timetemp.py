@@ -166,5 +166,5 @@ else:                  img.paste(Mph, (x, y))
 
 # Open connection to printer and print image
 printer = Adafruit_Thermal("/dev/serial0", 19200, timeout=5)
-printer.printImage(img, True)
+printer.printImage(img)
 printer.feed(3)
@@ -28,7 +28,6 @@
 
 from __future__ import print_function
 import base64, HTMLParser, httplib, json, sys, urllib, zlib
-from unidecode import unidecode
 from Adafruit_Thermal import *
 
 
@@ -48,6 +47,9 @@ queryString = 'from:Adafruit'
 # Other globals.  You probably won't need to change these. -----------------
 
 printer   = Adafruit_Thermal("/dev/serial0", 19200, timeout=5)
+# Unicode in tweets is mapped to the printer's code page 437 glyphs,
+# or to ASCII approximations where there's no such glyph
+printer.setCodePage(Adafruit_Thermal.CODEPAGE_CP437)
 host      = 'api.twitter.com'
 authUrl   = '/oauth2/token'
 searchUrl = '/1.1/search/tweets.json?'
@@ -105,23 +107,22 @@ maxId = data['search_metadata']['max_id_str']
 
 for tweet in data['statuses']:
 
+  # Name and date as full-width bars
   printer.inverseOn()
-  printer.print(' ' + '{:<31}'.format(tweet['user']['screen_name']))
+  printer.printWrapped(' ' + tweet['user']['screen_name'], pad=True)
   printer.inverseOff()
 
   printer.underlineOn()
-  printer.print('{:<32}'.format(tweet['created_at']))
+  printer.printWrapped(tweet['created_at'], pad=True)
   printer.underlineOff()
 
   # max_id_str is not always present, so check tweet IDs as fallback
   id = tweet['id_str']
   if(id > maxId): maxId = id # String compare is OK for this
 
-  # Remove HTML escape sequences
-  # and remap Unicode values to nearest ASCII equivalents
-  printer.print(unidecode(
-    HTMLParser.HTMLParser().unescape(tweet['text'])))
+  # Remove HTML escape sequences and word wrap
+  printer.printWrapped(HTMLParser.HTMLParser().unescape(tweet['text']))
 
-  printer.feed(3)
+  printer.feed(2)
 
 print(maxId) # Piped back to calling process